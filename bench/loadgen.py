@@ -0,0 +1,362 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import psutil
+import requests
+
+'''
+Drives the chatbot API with a fixed mix of requests and reports throughput, latency percentiles and peak memory.
+
+By default everything runs in a scratch directory: the stub Ollama from stub_ollama.py and the API (uvicorn with
+src.app.asgi:app, or the Flask development server with --server flask), pointed at the stub through LLM_BACKENDS.
+The fixture documents are uploaded and a crawled link is seeded before any request is timed. Each scenario then
+sends --requests requests from --concurrency threads, after --warmup requests that are not counted. With --url
+the load goes to a server that is already running instead; peak RSS is then not reported and chat_link needs
+--link.
+
+Scenarios: chat, chat_stream, chat_document, chat_link, chat_reasoning, store_memory, retrieve_latest_memory and
+document_upload. Chats send "cache": false so every request reaches the model. A request counts as an error
+when its status is not 2xx or a chat answers with "Error: ...".
+
+Results are printed as a table and written as JSON to --output (default bench/results/<time>.json). The file holds
+the configuration, the git commit and, per scenario, throughput, p50/p95/p99 latency (and time to first byte for
+streams), error counts and the peak RSS of the server and its worker processes. --compare prints the change
+against an earlier results file.
+
+Example usage:
+python bench/loadgen.py --concurrency 16 --requests 200
+python bench/loadgen.py --scenarios chat,chat_reasoning --stub-latency 0.5 --compare bench/results/baseline.json
+python bench/loadgen.py --url http://localhost:5000 --scenarios chat,store_memory
+'''
+
+BENCH_FOLDER = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_FOLDER)
+FIXTURES_FOLDER = os.path.join(BENCH_FOLDER, 'fixtures')
+SCENARIOS = ["chat", "chat_stream", "chat_document", "chat_link", "chat_reasoning", "store_memory",
+             "retrieve_latest_memory", "document_upload"]
+DOCUMENTS = ["sample.pdf", "sample.docx", "sample.json"]
+LINK_NAME = "https___bench.example.com_article.json"
+QUESTIONS = ["What does the document say about latency?", "Summarize the part about the cache.",
+             "Which workers handle the queue?", "What is the budget for retrieval?"]
+REASONING_QUESTIONS = ["Why would batching embeddings improve throughput?",
+                       "Compare streaming and buffered responses for a slow model.",
+                       "How should the queue depth change when the model gets slower?"]
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def summarize(values):
+    return {f"p{p}": round(percentile(values, p) * 1000, 1) if values else None for p in (50, 95, 99)}
+
+class MemorySampler:
+    def __init__(self, pid=None, interval=0.1):
+        self.process = psutil.Process(pid) if pid else None
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        if self.process is not None:
+            self.thread.start()
+        return self
+
+    # The server and its children, e.g. the ingestion workers
+    def rss(self):
+        total = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.peak = max(self.peak, self.rss())
+            except psutil.Error:
+                return
+
+    # Includes a sample taken now, so scenarios shorter than the interval get a value too
+    def take_peak(self):
+        if self.process is None:
+            return None
+        try:
+            self.peak = max(self.peak, self.rss())
+        except psutil.Error:
+            pass
+        peak, self.peak = self.peak, 0
+        return round(peak / 2**20, 1)
+
+    def stop(self):
+        self.stopped.set()
+
+class Stack:
+    def __init__(self, args):
+        self.args = args
+        self.folder = tempfile.mkdtemp(prefix="chatbot-bench-")
+        self.processes = []
+        self.log = open(os.path.join(self.folder, 'server.log'), 'w')
+
+    def spawn(self, command, env=None):
+        process = subprocess.Popen(command, cwd=self.folder, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def start(self):
+        args = self.args
+        stub = [sys.executable, os.path.join(BENCH_FOLDER, 'stub_ollama.py'), "--port", str(args.stub_port),
+                "--latency", str(args.stub_latency), "--tokens", str(args.stub_tokens),
+                "--tokens-per-second", str(args.stub_tokens_per_second)]
+        for model in args.stub_model or ():
+            stub += ["--model", model]
+        self.spawn(stub)
+
+        # The link library lists what is on disk at startup
+        os.makedirs(os.path.join(self.folder, 'links'))
+        shutil.copy(os.path.join(FIXTURES_FOLDER, 'sample_link.json'), os.path.join(self.folder, 'links', LINK_NAME))
+        env = dict(os.environ, LLM_BACKENDS=f"http://127.0.0.1:{args.stub_port}",
+                   READY_REQUIRES="sentence_model,chroma,memory_index", MEMORY_STORAGE="memory",
+                   PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+        if args.server == "flask":
+            command = [sys.executable, "-c", f"from src.app.chatbot import app; app.run(port={args.port}, threaded=True)"]
+        else:
+            command = [sys.executable, "-m", "uvicorn", "src.app.asgi:app", "--port", str(args.port), "--log-level", "warning"]
+        self.server = self.spawn(command, env)
+        return f"http://127.0.0.1:{args.port}"
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.log.close()
+        if self.args.keep:
+            print(f"Kept scratch directory {self.folder}")
+        else:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+def wait_ready(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/readyz", timeout=2).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} was not ready after {timeout}s")
+
+def upload(session, url, path, name=None):
+    with open(path, 'rb') as file:
+        return session.post(f"{url}/document_upload", files={"file": (name or os.path.basename(path), file)}, timeout=60)
+
+def wait_job(url, job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = requests.get(f"{url}/jobs/{job_id}", timeout=5).json()
+        if job.get("status") in ("completed", "failed"):
+            return job
+        time.sleep(0.2)
+    raise RuntimeError(f"Upload job {job_id} did not finish")
+
+def prepare(url):
+    session = requests.Session()
+    for name in DOCUMENTS:
+        response = upload(session, url, os.path.join(FIXTURES_FOLDER, name))
+        response.raise_for_status()
+        job = wait_job(url, response.json()["jobId"])
+        if job["status"] != "completed":
+            raise RuntimeError(f"Could not ingest {name}: {job.get('error')}")
+    # Index the fixtures now rather than inside the first timed requests
+    for name in DOCUMENTS:
+        session.post(f"{url}/chat", json={"message": "warm up", "document": name, "cache": False}, timeout=120)
+
+class Scenario:
+    def __init__(self, name, url, args):
+        self.name = name
+        self.url = url
+        self.args = args
+        self.local = threading.local()
+        self.uploaded = []
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def chat(self, i, **payload):
+        response = self.session().post(f"{self.url}/chat", json=dict(payload, cache=False, conversationId=f"bench-{i % 50}"), timeout=300)
+        error = not response.ok or str(response.json().get("response", "")).startswith("Error")
+        return error, None
+
+    def chat_stream(self, i):
+        started = time.perf_counter()
+        first_byte = None
+        body = b""
+        with self.session().post(f"{self.url}/chat", json={"message": QUESTIONS[i % len(QUESTIONS)], "stream": True, "cache": False,
+                                                           "conversationId": f"bench-{i % 50}"}, stream=True, timeout=300) as response:
+            for chunk in response.iter_content(chunk_size=None):
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                body += chunk
+        return not response.ok or b'"done": true' not in body, first_byte
+
+    def call(self, i):
+        if self.name == "chat":
+            return self.chat(i, message=QUESTIONS[i % len(QUESTIONS)])
+        if self.name == "chat_stream":
+            return self.chat_stream(i)
+        if self.name == "chat_document":
+            return self.chat(i, message=QUESTIONS[i % len(QUESTIONS)], document=DOCUMENTS[i % len(DOCUMENTS)])
+        if self.name == "chat_link":
+            return self.chat(i, message=QUESTIONS[i % len(QUESTIONS)], link=self.args.link or LINK_NAME)
+        if self.name == "chat_reasoning":
+            return self.chat(i, message=REASONING_QUESTIONS[i % len(REASONING_QUESTIONS)], reasoning=True)
+        if self.name == "store_memory":
+            response = self.session().post(f"{self.url}/store_memory", json={
+                "userMessage": {"text": f"benchmark message {i}: {QUESTIONS[i % len(QUESTIONS)]}"},
+                "botMessage": {"text": f"benchmark answer {i}"}, "conversationId": f"bench-{i % 50}"}, timeout=60)
+            return not response.ok, None
+        if self.name == "retrieve_latest_memory":
+            response = self.session().post(f"{self.url}/retrieve_latest_memory", json={"conversationId": f"bench-{i % 50}"}, timeout=60)
+            return not response.ok, None
+        if self.name == "document_upload":
+            source = DOCUMENTS[i % len(DOCUMENTS)]
+            name = f"bench-upload-{i}{os.path.splitext(source)[1]}"
+            response = upload(self.session(), self.url, os.path.join(FIXTURES_FOLDER, source), name)
+            self.uploaded.append(name)
+            return response.status_code != 202, None
+        raise ValueError(f"Unknown scenario {self.name}")
+
+    def timed(self, i):
+        started = time.perf_counter()
+        try:
+            error, first_byte = self.call(i)
+        except (requests.exceptions.RequestException, ValueError):
+            error, first_byte = True, None
+        return time.perf_counter() - started, first_byte, error
+
+    def run(self, memory):
+        args = self.args
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(self.timed, range(args.warmup)))
+            memory.take_peak()
+            started = time.perf_counter()
+            samples = list(pool.map(self.timed, range(args.warmup, args.warmup + args.requests)))
+            elapsed = time.perf_counter() - started
+        latencies = [latency for latency, _, error in samples if not error]
+        first_bytes = [first_byte for _, first_byte, error in samples if first_byte is not None and not error]
+        result = {"requests": len(samples), "errors": sum(error for _, _, error in samples),
+                  "seconds": round(elapsed, 3), "throughput": round(len(latencies) / elapsed, 2),
+                  "latency_ms": summarize(latencies), "peak_rss_mb": memory.take_peak()}
+        if first_bytes:
+            result["first_byte_ms"] = summarize(first_bytes)
+        return result
+
+    def cleanup(self):
+        for name in self.uploaded:
+            try:
+                requests.post(f"{self.url}/document_delete", json={"filename": name}, timeout=10)
+            except requests.exceptions.RequestException:
+                pass
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_table(results, baseline=None):
+    print(f"{'scenario':<24}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'rss MB':>9}")
+    for name, result in results.items():
+        latency = result["latency_ms"]
+        print(f"{name:<24}{result['throughput']:>9}{latency['p50'] or '-':>10}{latency['p95'] or '-':>10}"
+              f"{latency['p99'] or '-':>10}{result['errors']:>8}{result['peak_rss_mb'] or '-':>9}")
+        old = (baseline or {}).get(name)
+        if old and old["throughput"] and latency["p95"] and old["latency_ms"]["p95"]:
+            print(f"{'  vs baseline':<24}{(result['throughput'] / old['throughput'] - 1) * 100:>+8.1f}%"
+                  f"{(latency['p50'] / old['latency_ms']['p50'] - 1) * 100:>+9.1f}%"
+                  f"{(latency['p95'] / old['latency_ms']['p95'] - 1) * 100:>+9.1f}%"
+                  f"{(latency['p99'] / old['latency_ms']['p99'] - 1) * 100:>+9.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chatbot API")
+    parser.add_argument("--url", help="drive an already running server instead of starting one")
+    parser.add_argument("--server", choices=["asgi", "flask"], default="asgi")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per scenario")
+    parser.add_argument("--link", help="link to chat about when using --url")
+    parser.add_argument("--stub-port", type=int, default=11500)
+    parser.add_argument("--stub-latency", type=float, default=0.2)
+    parser.add_argument("--stub-tokens", type=int, default=64)
+    parser.add_argument("--stub-tokens-per-second", type=float, default=80)
+    parser.add_argument("--stub-model", action="append", help="NAME=LATENCY:TOKENS_PER_SECOND, see stub_ollama.py")
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--output", help="results file, default bench/results/<time>.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory and server log")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario {name}, choose from {', '.join(SCENARIOS)}")
+    if args.url and "chat_link" in scenarios and not args.link:
+        parser.error("chat_link against --url needs --link")
+
+    stack = None if args.url else Stack(args)
+    try:
+        url = args.url.rstrip('/') if args.url else stack.start()
+        wait_ready(url, args.ready_timeout)
+        if any(name in scenarios for name in ("chat_document", "document_upload")):
+            prepare(url)
+        memory = MemorySampler(stack.server.pid if stack else None).start()
+        results = {}
+        for name in scenarios:
+            scenario = Scenario(name, url, args)
+            print(f"Running {name}...", flush=True)
+            results[name] = scenario.run(memory)
+            scenario.cleanup()
+        memory.stop()
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    report = {"started": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+              "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep")},
+              "scenarios": results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["scenarios"]
+    print_table(results, baseline)
+
+    output = args.output or os.path.join(BENCH_FOLDER, 'results', f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {output}")
+
+if __name__ == "__main__":
+    main()
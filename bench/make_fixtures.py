@@ -0,0 +1,95 @@
+import json
+import os
+import random
+
+'''
+Writes the documents used by the benchmarks into bench/fixtures.
+
+The text is generated from a fixed seed, so the fixtures have the same content every time they are rebuilt:
+a multi-page PDF, a DOCX, a JSON file and a crawled link (the JSON string /link_upload stores). The PDF is written
+by hand with Helvetica text, so only python-docx is needed. The generated files are checked in; rerun this only
+to change them.
+
+Example usage:
+python bench/make_fixtures.py --paragraphs 120
+'''
+
+FIXTURES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WORDS = ("latency throughput model token context memory document query vector index cache request response "
+         "server client stream batch queue worker thread process embedding chunk retrieval prompt answer "
+         "question summary reasoning budget network storage upload extraction metric benchmark replica "
+         "the a of to and in is for that with on as by it this are from be at or an").split()
+
+def paragraphs(count, seed=7):
+    rng = random.Random(seed)
+    result = []
+    for _ in range(count):
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        result.append(" ".join(sentences))
+    return result
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def wrap(text, width=90):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    return lines + [line] if line else lines
+
+def write_pdf(path, texts, lines_per_page=48):
+    lines = [line for text in texts for line in wrap(text) + [""]]
+    pages = [lines[start:start + lines_per_page] for start in range(0, len(lines), lines_per_page)]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        stream = "BT /F1 10 Tf 14 TL 50 760 Td\n" + "\n".join(f"({pdf_escape(line)}) '" for line in page) + "\nET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as file:
+        file.write(output)
+
+def write_docx(path, texts):
+    from datetime import datetime
+    from docx import Document
+    document = Document()
+    document.core_properties.created = document.core_properties.modified = datetime(2025, 1, 1)
+    for text in texts:
+        document.add_paragraph(text)
+    document.save(path)
+
+def write_fixtures(count=120):
+    os.makedirs(FIXTURES_FOLDER, exist_ok=True)
+    texts = paragraphs(count)
+    write_pdf(os.path.join(FIXTURES_FOLDER, 'sample.pdf'), texts)
+    write_docx(os.path.join(FIXTURES_FOLDER, 'sample.docx'), texts)
+    with open(os.path.join(FIXTURES_FOLDER, 'sample.json'), 'w') as file:
+        json.dump([{"id": i, "title": text.split('.')[0], "body": text} for i, text in enumerate(texts)], file, indent=1)
+    with open(os.path.join(FIXTURES_FOLDER, 'sample_link.json'), 'w') as file:
+        json.dump("\n\n".join(f"## Section {i}\n{text}" for i, text in enumerate(texts)), file)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Rebuild the benchmark fixtures")
+    parser.add_argument("--paragraphs", type=int, default=120)
+    write_fixtures(parser.parse_args().paragraphs)
+    print(f"Wrote fixtures to {FIXTURES_FOLDER}")
@@ -0,0 +1,142 @@
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+'''
+A stand-in for Ollama's /api/generate and /api/tags, so the chatbot can be benchmarked without a GPU.
+
+Every generation first spends --latency seconds plus one second per --prompt-tokens-per-second prompt tokens on
+"prompt evaluation", then produces --tokens tokens at --tokens-per-second. Only the prompt tokens that are not
+already covered by the request's context are evaluated, like Ollama reusing its cache, so reusing conversation
+context shows up in the numbers. Streaming requests get Ollama's NDJSON chunks as the tokens are produced, and
+the others get one JSON object once generation is done. Responses carry the same fields as Ollama's: context,
+prompt_eval_count, eval_count and the *_duration timings in nanoseconds.
+
+--model NAME=LATENCY:TOKENS_PER_SECOND overrides the speed of one model and can be repeated, e.g. to make the
+reasoning model slower. GET /stats returns the number of generations, tokens and aborted streams so far.
+
+Example usage:
+python bench/stub_ollama.py --port 11434 --latency 0.2 --tokens 64 --tokens-per-second 80
+python bench/stub_ollama.py --model deepseek-r1:1.5b=0.5:30
+'''
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.aborted = 0
+
+    def add(self, prompt_tokens, completion_tokens, aborted=False):
+        with self.lock:
+            self.generations += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.aborted += aborted
+
+    def snapshot(self):
+        with self.lock:
+            return {"generations": self.generations, "prompt_tokens": self.prompt_tokens,
+                    "completion_tokens": self.completion_tokens, "aborted": self.aborted}
+
+def parse_models(entries):
+    models = {}
+    for entry in entries or ():
+        name, _, speed = entry.rpartition('=')
+        latency, _, tokens_per_second = speed.partition(':')
+        models[name] = (float(latency), float(tokens_per_second))
+    return models
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+    stats = StubStats()
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, payload):
+        line = (json.dumps(payload) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self.send_json({"models": [{"name": name} for name in self.config.model_names]})
+        if self.path == "/stats":
+            return self.send_json(self.stats.snapshot())
+        self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            return self.send_json({"error": "not found"}, 404)
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "")
+        latency, tokens_per_second = self.config.models.get(model, (self.config.latency, self.config.tokens_per_second))
+        context = list(request.get("context") or [])
+        prompt = [hash(word) % 32000 for word in request.get("prompt", "").split()]
+        prompt_eval_seconds = latency + len(prompt) / self.config.prompt_tokens_per_second
+        started = time.perf_counter()
+        time.sleep(prompt_eval_seconds)
+
+        tokens = [f"token{i} " for i in range(self.config.tokens)]
+        final = {"model": model, "done": True, "context": context + prompt + list(range(len(tokens))),
+                 "prompt_eval_count": len(prompt), "eval_count": len(tokens),
+                 "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+                 "eval_duration": int(len(tokens) / tokens_per_second * 1e9), "load_duration": 0}
+        if not request.get("stream", True):
+            time.sleep(len(tokens) / tokens_per_second)
+            final.update(response="".join(tokens), total_duration=int((time.perf_counter() - started) * 1e9))
+            self.stats.add(len(prompt), len(tokens))
+            return self.send_json(final)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        try:
+            for token in tokens:
+                time.sleep(1 / tokens_per_second)
+                self.send_chunk({"model": model, "response": token, "done": False})
+                sent += 1
+            final.update(response="", total_duration=int((time.perf_counter() - started) * 1e9))
+            self.send_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.stats.add(len(prompt), sent, aborted=True)
+            return
+        self.stats.add(len(prompt), sent)
+
+def serve(port=11434, latency=0.2, tokens=64, tokens_per_second=80, prompt_tokens_per_second=2000, models=None):
+    config = argparse.Namespace(latency=latency, tokens=tokens, tokens_per_second=tokens_per_second,
+                                prompt_tokens_per_second=prompt_tokens_per_second, models=models or {})
+    config.model_names = sorted(set(config.models) | {"llama3.2:1B", "deepseek-r1:1.5b"})
+    handler = type("ConfiguredStubOllama", (StubOllama,), {"config": config, "stats": StubStats()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server for benchmarks")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per response")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=2000)
+    parser.add_argument("--model", action="append", help="NAME=LATENCY:TOKENS_PER_SECOND")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.tokens, args.tokens_per_second, args.prompt_tokens_per_second, parse_models(args.model))
+    print(f"Stub Ollama listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
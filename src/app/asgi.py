@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+
+from src.app.chatbot import app as flask_app, chatbot, memory_recall, sse_event
+from src.app.recall import format_memories
+from src.app.metrics import HTTP_REQUEST_SECONDS, HTTP_IN_FLIGHT
+from src.app.scheduler import SchedulerBusy
+
+'''
+This module is the ASGI entry point for the chatbot API. Run it with:
+
+uvicorn src.app.asgi:app --port 5000
+
+/chat is served natively on the event loop: LLM calls go through the asyncio methods of LLMIntegration, so a
+request waiting on the model holds a coroutine, not a thread, and one process can keep thousands of them open.
+Document and link retrieval (file reads and embeddings) runs on the worker threadpool. When the client disconnects,
+the task generating its answer is cancelled, which closes the request to Ollama and skips the remaining stages
+of a reasoning chain; for streams Starlette does this itself.
+
+Every other route is the Flask app from chatbot.py mounted behind WSGIMiddleware, which runs it on the same
+threadpool. That covers the Chroma routes as well, since the Chroma client is synchronous. The two entry points
+share one Chatbot, so documents, caches and conversation contexts are the same whichever one serves a request.
+
+Example usage:
+curl -N -X POST localhost:5000/chat -H 'Content-Type: application/json' -d '{"message": "Hi", "stream": true}'
+'''
+
+# Times the routes served here; the mounted Flask app times its own
+class RequestMetrics:
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.routes:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=scope["path"], method=scope["method"], status=message["status"])
+            await send(message)
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+
+app = FastAPI()
+app.add_middleware(CORSMiddleware, allow_origins=["http://localhost:3000"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(RequestMetrics, routes={"/chat", "/healthz"})
+
+def sse_response(events):
+    return StreamingResponse(events, media_type='text/event-stream',
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def astream_stage(stage, tokens, parts):
+    async for token in tokens:
+        parts.append(token)
+        yield sse_event({"stage": stage, "token": token})
+
+async def astream_simple_chat(user_input, session=None, chunks=(), use_cache=True, schedule=None):
+    response = []
+    async for event in astream_stage("response", chatbot.astream_simple_response(user_input, session, chunks, use_cache, schedule), response):
+        yield event
+    yield sse_event({"stage": "response", "done": True, "response": "".join(response)})
+
+async def astream_reasoned_chat(user_input, session=None, chunks=(), use_cache=True, schedule=None, question=None):
+    async for event in chatbot.pipeline.astream(chatbot, user_input, session, chunks, use_cache=use_cache, schedule=schedule, question=question):
+        yield sse_event(event)
+
+# Run the answer as a task and cancel it if the client disconnects first
+async def until_disconnected(request, coroutine, respond=lambda response: {'response': response}, interval=0.25):
+    task = asyncio.ensure_future(coroutine)
+    while not task.done():
+        await asyncio.wait({task}, timeout=interval)
+        if not task.done() and await request.is_disconnected():
+            task.cancel()
+            return JSONResponse({'response': 'Error: Client disconnected'}, 499)
+    return respond(task.result())
+
+@app.get('/healthz')
+async def healthz():
+    return {"status": "ok"}
+
+# Same request and response format as the Flask /chat route
+@app.post('/chat')
+async def chat(request: Request):
+    data = await request.json()
+    user_input = data.get('message')
+    document_name = data.get('document')
+    link = data.get('link')
+    memories = data.get('memories')
+    stream = data.get('stream')
+    conversation_id = data.get('conversationId')
+    use_cache = data.get('cache', True) is not False
+
+    if not user_input:
+        return {'response': 'Error: Empty input'}
+
+    if len(user_input) > 512:
+        return {'response': 'Error: Input too long'}
+
+    if not isinstance(user_input, str):
+        return {'response': 'Error: Invalid input type'}
+
+    try:
+        schedule = chatbot.admit(conversation_id, data.get('reasoning'))
+    except SchedulerBusy as e:
+        return JSONResponse({'response': f'Error: {e}'}, 429, {'Retry-After': str(e.retry_after)})
+
+    if user_input.lower() == '/bye':
+        formatted_inquiry = f"Am trying to say goodbye to you. Please wish me well."
+        if stream:
+            return sse_response(astream_simple_chat(formatted_inquiry, use_cache=use_cache, schedule=schedule))
+        return await until_disconnected(request, chatbot.aget_simple_response(formatted_inquiry, use_cache=use_cache, schedule=schedule))
+
+    if memories:
+        for memory in memories:
+            print(f"Memory: {memory}")
+
+    relevant_memories = await run_in_threadpool(memory_recall.recall, user_input, conversation_id)
+    memories_input = f"{user_input}\n\n{format_memories(relevant_memories)}" if relevant_memories else user_input
+
+    session = (str(conversation_id), document_name, link) if conversation_id is not None else None
+
+    try:
+        if data.get('reasoning'):
+            if document_name and document_name not in chatbot.documents:
+                return {'response': 'Error: Document not found'}
+            if link and link not in chatbot.links:
+                return {'response': 'Error: Link not found'}
+            reasoning_input, chunks = await run_in_threadpool(chatbot.get_reasoning_prompt, document_name, link, memories_input)
+            if stream:
+                return sse_response(astream_reasoned_chat(reasoning_input, session, chunks, use_cache, schedule, user_input))
+            return await until_disconnected(request, chatbot.pipeline.arun(chatbot, reasoning_input, session, chunks, use_cache=use_cache, schedule=schedule, question=user_input),
+                                            lambda result: {'response': result[0], 'timings': result[1]})
+        elif document_name:
+            if document_name not in chatbot.documents:
+                return {'response': 'Error: Document not found'}
+            combined_input, chunks = await run_in_threadpool(chatbot.get_document_prompt, document_name, memories_input, session)
+        elif link:
+            if link not in chatbot.links:
+                return {'response': 'Error: Link not found'}
+            combined_input, chunks = await run_in_threadpool(chatbot.get_link_prompt, link, memories_input, session)
+        else:
+            combined_input, chunks = memories_input, ()
+
+        if stream:
+            return sse_response(astream_simple_chat(combined_input, session, chunks, use_cache, schedule))
+        return await until_disconnected(request, chatbot.aget_simple_response(combined_input, session, chunks, use_cache, schedule))
+    except Exception as e:
+        return {'response': f'Error: {e}'}
+
+# Everything else is served by the Flask app
+app.mount("/", WSGIMiddleware(flask_app))
@@ -0,0 +1,78 @@
+import socket
+import threading
+import time
+
+'''
+This module lets a request stop its LLM work once the client that asked for it has gone away.
+
+A CancelToken is handed to LLMIntegration calls. It is set either explicitly with cancel() or when its check
+function says so; for Flask requests the check peeks at the client socket, which reads as closed once the
+browser aborts the fetch. The check runs at most every interval seconds, so it is cheap to poll between tokens.
+When a streamed generation sees the token set it closes the upstream response, which makes Ollama stop.
+
+ComputeSavings counts the generations that were aborted and the pipeline stages that were skipped, and estimates
+the model time saved from the average duration of completed generations of the same model.
+
+Example usage:
+cancel = CancelToken(lambda: peer_closed(request.environ.get("werkzeug.socket")))
+response = llm_integration.generate_simple_response(prompt, cancel=cancel)
+print(llm_integration.savings.stats())          # aborted, skipped_stages, saved_seconds
+'''
+
+def peer_closed(sock):
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError):
+        return False                                                            # Nothing to read, the connection is still open
+    except OSError:
+        return True
+
+class CancelToken:
+    def __init__(self, check=None, interval=0.25):
+        self.check = check
+        self.interval = interval
+        self.cancelled = False
+        self.checked = 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_set(self):
+        if not self.cancelled and self.check is not None and time.monotonic() - self.checked >= self.interval:
+            self.checked = time.monotonic()
+            self.cancelled = bool(self.check())
+        return self.cancelled
+
+class ComputeSavings:
+    def __init__(self):
+        self.durations = {}                                                     # model -> moving average of seconds per generation
+        self.aborted_count = 0
+        self.skipped_count = 0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def completed(self, model, seconds):
+        with self.lock:
+            average = self.durations.get(model)
+            self.durations[model] = seconds if average is None else 0.9 * average + 0.1 * seconds
+
+    def aborted(self, model, elapsed):
+        with self.lock:
+            self.aborted_count += 1
+            self.saved_seconds += max(0.0, self.durations.get(model, 0.0) - elapsed)
+
+    def skipped(self, model):
+        with self.lock:
+            self.skipped_count += 1
+            self.saved_seconds += self.durations.get(model, 0.0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "aborted": self.aborted_count,
+                "skipped_stages": self.skipped_count,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "average_seconds": {model: round(seconds, 3) for model, seconds in self.durations.items()}
+            }
@@ -1,31 +1,97 @@
-from flask import Flask, request, jsonify
+from src.app.startup import LazyResource, StartupTimer
+startup_timer = StartupTimer()
+
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 from src.app.llm_integration import LLMIntegration
-import PyPDF2
+from src.app.retrieval import ChunkIndex
+from src.app.embeddings import EmbeddingService, EmbeddingCache
+from src.app.library import DocumentLibrary
+from src.app.memory_index import MemoryIndex, to_epoch
+from src.app.crawler import CrawlerPool
+from src.app.ingestion import IngestionQueue, IngestionQueueFull
+from src.app.context_cache import ContextCache
+from src.app.response_cache import ResponseCache
+from src.app.llm_router import LLMRouter, parse_backends
+from src.app.scheduler import LLMScheduler, SchedulerBusy, PRIORITY_SIMPLE, PRIORITY_REASONING, PRIORITY_BACKGROUND, parse_slots
+from src.app.cancellation import CancelToken, peer_closed
+from src.app.pipeline import Pipeline, parse_pipeline
+from src.app.recall import MemoryRecall, format_memories
+from src.app.compaction import MemoryCompactor, memory_id
+from src.app.metrics import REGISTRY, STAGE_SECONDS, HTTP_REQUEST_SECONDS, HTTP_IN_FLIGHT
+from src.app import extractors
 import json
-import docx
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import os
-import asyncio
-from crawl4ai import AsyncWebCrawler
-import chromadb
-from sentence_transformers import SentenceTransformer
+import time
+import uuid
+import xxhash
 from datetime import datetime
-import json
 
 app = Flask(__name__)
+startup_timer.mark("imports")
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
 
 CHATS_FOLDER = 'chats'
 DOCUMENTS_FOLDER = 'documents'
 LINKS_FOLDER = 'links'
 UPLOADS_FOLDER = 'uploads'
+CHROMA_FOLDER = 'chroma'
+MEMORY_STORAGE = os.environ.get('MEMORY_STORAGE', 'persistent')                # 'persistent' keeps memories in CHROMA_FOLDER, 'memory' drops them on exit
 ALLOWED_EXTENSIONS = {'pdf', 'txt', 'json', 'docx'}
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 4))
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get('RETRIEVAL_TOKEN_BUDGET', 1024))
+BULK_MEMORY_LIMIT = 5000
+UPSERT_BATCH_SIZE = 1000
+LATEST_MEMORY_LIMIT = 5
+MEMORY_PAGE_LIMIT = 500
+LINK_UPLOAD_LIMIT = 20                                                          # URLs accepted by one /link_upload
+CRAWLER_CONTEXTS = int(os.environ.get('CRAWLER_CONTEXTS', 4))                   # Pages open at once in the shared browser
+CRAWLER_PER_HOST = int(os.environ.get('CRAWLER_PER_HOST', 2))
+CRAWL_TIMEOUT = int(os.environ.get('CRAWL_TIMEOUT', 60))
+INGESTION_WORKERS = int(os.environ.get('INGESTION_WORKERS', 2))                 # Processes extracting uploaded documents
+INGESTION_QUEUE_LIMIT = int(os.environ.get('INGESTION_QUEUE_LIMIT', 32))         # Uploads queued or extracting at once
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 200 * 1024 * 1024))
+MAX_DOCUMENT_CHARS = int(os.environ.get('MAX_DOCUMENT_CHARS', 50_000_000))      # Extraction stops once a document's text grows past this
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 10000))
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH')                  # e.g. embeddings.db to keep the cache across restarts
+CONTEXT_CACHE_CONVERSATIONS = int(os.environ.get('CONTEXT_CACHE_CONVERSATIONS', 256))  # Conversations whose Ollama context is kept between turns
+CONTEXT_CACHE_TOKENS = int(os.environ.get('CONTEXT_CACHE_TOKENS', 2_000_000))   # Tokens kept across all of them
+CONTEXT_MAX_TOKENS = int(os.environ.get('CONTEXT_MAX_TOKENS', 8192))            # Longer contexts start over instead of being truncated by Ollama
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))          # Finished LLM responses kept for identical requests
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 600))             # Seconds before a cached response is generated again
+LLM_BACKENDS = os.environ.get('LLM_BACKENDS', '')                              # e.g. "http://gpu1:11434=llama3.2:1B;http://gpu2:11434", empty for localhost only
+LLM_HEALTH_INTERVAL = float(os.environ.get('LLM_HEALTH_INTERVAL', 10))          # Seconds between backend health checks
+SIMPLE_MODEL = os.environ.get('SIMPLE_MODEL', 'llama3.2:1B')
+REASONED_MODEL = os.environ.get('REASONED_MODEL', 'deepseek-r1:1.5b')
+LLM_SLOTS = parse_slots(os.environ.get('LLM_SLOTS', ''))                       # e.g. "llama3.2:1B=4,deepseek-r1:1.5b=1"
+LLM_DEFAULT_SLOTS = int(os.environ.get('LLM_DEFAULT_SLOTS', 4))                 # Requests sent to a model at once when not listed in LLM_SLOTS
+LLM_QUEUE_LIMIT = int(os.environ.get('LLM_QUEUE_LIMIT', 64))                    # Requests waiting per model before new ones get 429
+LLM_QUEUE_DEADLINE = float(os.environ.get('LLM_QUEUE_DEADLINE', 30))            # Seconds a request may wait for its model
+REASONING_PIPELINE = os.environ.get('REASONING_PIPELINE', 'reasoning=reasoned,final=simple')  # "draft=simple,reasoning=reasoned,final=simple" for the full chain
+MEMORY_RECALL_TOP_K = int(os.environ.get('MEMORY_RECALL_TOP_K', 3))             # Past turns of the conversation added to a chat prompt
+MEMORY_RECALL_BUDGET_MS = float(os.environ.get('MEMORY_RECALL_BUDGET_MS', 150))  # Chats go ahead without memories when recall takes longer, 0 turns it off
+MEMORY_RECALL_HALF_LIFE = float(os.environ.get('MEMORY_RECALL_HALF_LIFE', 7 * 86400))  # Seconds after which a memory's recency score halves
+MEMORY_RECALL_RECENCY_WEIGHT = float(os.environ.get('MEMORY_RECALL_RECENCY_WEIGHT', 0.3))
+MEMORY_MAX_TURNS = int(os.environ.get('MEMORY_MAX_TURNS', 1000))                # Turns kept per conversation; the oldest go first
+MEMORY_TTL = float(os.environ.get('MEMORY_TTL', 0))                             # Seconds a turn is kept, 0 keeps turns until the cap removes them
+MEMORY_COMPACT_AFTER = int(os.environ.get('MEMORY_COMPACT_AFTER', 200))         # Conversations with more turns get their older turns summarized
+MEMORY_COMPACT_KEEP = int(os.environ.get('MEMORY_COMPACT_KEEP', 50))            # Newest turns never summarized
+MEMORY_COMPACT_GROUP = int(os.environ.get('MEMORY_COMPACT_GROUP', 10))          # Turns merged into one summary
+MEMORY_COMPACT_INTERVAL = float(os.environ.get('MEMORY_COMPACT_INTERVAL', 300))  # Seconds between background compactions, 0 turns them off
+MEMORY_COMPACT_SUMMARIZE = os.environ.get('MEMORY_COMPACT_SUMMARIZE', '1') == '1'  # Have the simple model write the summaries instead of joining the texts
+REASONING_MODE = os.environ.get('REASONING_MODE', 'auto')                      # 'auto' skips the reasoner for questions that do not need it, or 'always', 'never'
+WARM_START = os.environ.get('WARM_START', '1') == '1'                          # Load the embedding model and Chroma in the background at startup
+SPAWNED = __name__ == '__mp_main__'                                            # Imported again by a spawned extraction worker, see ingestion.py
+READY_REQUIRES = [name for name in os.environ.get('READY_REQUIRES', '').split(',') if name]
 
 app.config['CHATS_FOLDER'] = CHATS_FOLDER
 app.config['DOCUMENTS_FOLDER'] = DOCUMENTS_FOLDER
 app.config['LINKS_FOLDER'] = LINKS_FOLDER
 app.config['UPLOADS_FOLDER'] = UPLOADS_FOLDER
+app.config['CHROMA_FOLDER'] = CHROMA_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 
 if not os.path.exists(CHATS_FOLDER):
     os.makedirs(CHATS_FOLDER)
@@ -39,98 +105,401 @@ if not os.path.exists(LINKS_FOLDER):
 if not os.path.exists(UPLOADS_FOLDER):
     os.makedirs(UPLOADS_FOLDER)
 
-chroma_client = chromadb.Client()       
-collection = chroma_client.get_or_create_collection(name="chatbot_memory")
-sentence_model = SentenceTransformer('all-MiniLM-L6-v2')
+startup_timer.mark("folders")
+
+def open_memory_collection():
+    import chromadb
+    if MEMORY_STORAGE == 'persistent':
+        chroma_client = chromadb.PersistentClient(path=CHROMA_FOLDER)
+    else:
+        chroma_client = chromadb.Client()
+    collection = chroma_client.get_or_create_collection(name="chatbot_memory")
+    print(f"Restored {collection.count()} memories")
+    return collection
+
+def open_memory_index():
+    collection = get_collection()                                               # Creates CHROMA_FOLDER if needed
+    path = os.path.join(CHROMA_FOLDER, 'memory_index.db') if MEMORY_STORAGE == 'persistent' else ':memory:'
+    index = MemoryIndex(path)
+    migrate_memory_vectors(index, collection)
+    return index
+
+# Vectors stored before the index held the turns carry the whole turn as a JSON blob under "metadata". Each turn
+# goes into the index once (under the turn id it already has there, if any) and its vectors are rewritten with
+# scalar metadata and content-addressed ids.
+def migrate_memory_vectors(index, collection):
+    legacy = []
+    for start in range(0, collection.count(), UPSERT_BATCH_SIZE):
+        page = collection.get(include=["metadatas"], limit=UPSERT_BATCH_SIZE, offset=start)
+        legacy.extend(id for id, metadata in zip(page["ids"], page["metadatas"]) if metadata and "metadata" in metadata)
+    if not legacy:
+        return
+
+    known = {xxhash.xxh3_64_hexdigest(metadata_json): turn_id for turn_id, metadata_json in index.rows()}
+    for start in range(0, len(legacy), UPSERT_BATCH_SIZE):
+        page = collection.get(ids=legacy[start:start + UPSERT_BATCH_SIZE], include=["metadatas", "embeddings", "documents"])
+        turns = {}
+        records = []
+        for legacy_id, metadata, embedding, text in zip(page["ids"], page["metadatas"], page["embeddings"], page["documents"]):
+            try:
+                memory = json.loads(metadata["metadata"])
+            except ValueError:
+                continue                                                        # Never readable; dropped with the rest
+            digest = xxhash.xxh3_64_hexdigest(metadata["metadata"])
+            turn_id = known.get(digest)
+            if turn_id is None:
+                turn_id = digest
+                turns[turn_id] = (turn_id, memory.get("conversationId"), memory.get("timestamp"), metadata["metadata"])
+            text = text or legacy_id                                            # The text used to be the id
+            records.append({"id": memory_id(memory.get("conversationId"), text),
+                            "text": text,
+                            "embedding": list(embedding),
+                            "metadata": vector_metadata(memory, turn_id, memory_role(memory, text)),
+                            "item": turn_id,
+                            "legacy_id": legacy_id})
+        index.add_many(turns.values())
+        failed = upsert_memory_records(records, collection)
+        kept = {record["legacy_id"] for record in records if record["item"] in failed}
+        collection.delete(ids=[legacy_id for legacy_id in page["ids"] if legacy_id not in kept])
+    print(f"Migrated {len(legacy)} stored memory vectors")
+
+def load_sentence_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer('all-MiniLM-L6-v2')
+
+def load_crawler():
+    from crawl4ai import AsyncWebCrawler
+    return CrawlerPool(AsyncWebCrawler, CRAWLER_CONTEXTS, CRAWLER_PER_HOST, CRAWL_TIMEOUT).start()
+
+# Heavy dependencies load on first use, or in the background when WARM_START is on
+memory_collection = LazyResource("chroma", open_memory_collection)
+memory_index = LazyResource("memory_index", open_memory_index)
+sentence_model = LazyResource("sentence_model", load_sentence_model)
+web_crawler = LazyResource("crawler", load_crawler)
+embedding_service = EmbeddingService(sentence_model, cache=EmbeddingCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH))
+memory_recall = MemoryRecall(embedding_service.encode, memory_collection.get, memory_index.get, (sentence_model, memory_collection, memory_index), MEMORY_RECALL_TOP_K,
+                             budget_ms=MEMORY_RECALL_BUDGET_MS, half_life=MEMORY_RECALL_HALF_LIFE,
+                             recency_weight=MEMORY_RECALL_RECENCY_WEIGHT)
+
+def get_collection():
+    return memory_collection.get()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 class Chatbot:
-    def __init__(self, api_url):
-        self.llm_integration = LLMIntegration(api_url)
-        self.documents = {}
-        self.links = {}
+    def __init__(self, api_url, router=None):
+        self.scheduler = LLMScheduler(LLM_SLOTS, LLM_DEFAULT_SLOTS, LLM_QUEUE_LIMIT, LLM_QUEUE_DEADLINE)
+        self.llm_integration = LLMIntegration(api_url, response_cache=ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL),
+                                              router=router, simple_model=SIMPLE_MODEL, reasoned_model=REASONED_MODEL,
+                                              scheduler=self.scheduler)
+        # Files already on disk are listed immediately and only extracted when first used
+        self.documents = DocumentLibrary(DOCUMENTS_FOLDER, self.extract_document_to_file, ALLOWED_EXTENSIONS)
+        self.links = DocumentLibrary(LINKS_FOLDER, self.read_link_file, {'json'}, to_file=False)
+        self.document_chunks = ChunkIndex(embedding_service, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET)
+        self.link_chunks = ChunkIndex(embedding_service, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET)
+        # Ollama context per (conversationId, document, link); only the simple model, which answers the user, keeps one
+        self.contexts = ContextCache(CONTEXT_CACHE_CONVERSATIONS, CONTEXT_CACHE_TOKENS, CONTEXT_MAX_TOKENS)
+        self.pipeline = Pipeline(parse_pipeline(REASONING_PIPELINE), REASONING_MODE)
 
     def preprocess_input(self, user_input):
         return user_input.strip().lower()
 
-    def get_reasoned_response(self, user_input):
+    def get_reasoned_response(self, user_input, use_cache=True, schedule=None, cancel=None):
         processed_input = self.preprocess_input(user_input)
-        reasoned_response = self.llm_integration.generate_reasoned_response(processed_input)
+        reasoned_response = self.llm_integration.generate_reasoned_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel)
         return reasoned_response
 
-    def get_simple_response(self, user_input):
+    def get_simple_response(self, user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None):
         processed_input = self.preprocess_input(user_input)
-        simple_response = self.llm_integration.generate_simple_response(processed_input)
+        simple_response = self.llm_integration.generate_simple_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel, **self.session_options(session, chunks))
         return simple_response
 
+    def stream_reasoned_response(self, user_input, use_cache=True, schedule=None, cancel=None):
+        processed_input = self.preprocess_input(user_input)
+        return self.llm_integration.stream_reasoned_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel)
+
+    def stream_simple_response(self, user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None):
+        processed_input = self.preprocess_input(user_input)
+        return self.llm_integration.stream_simple_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel, **self.session_options(session, chunks))
+
+    # Raise SchedulerBusy if the models a chat needs are too backed up; returns the schedule for its LLM calls
+    def admit(self, conversation_id=None, reasoning=False):
+        priority = PRIORITY_REASONING if reasoning else PRIORITY_SIMPLE
+        self.scheduler.check(SIMPLE_MODEL, priority)
+        if reasoning:
+            self.scheduler.check(REASONED_MODEL, priority)
+        return (conversation_id, priority)
+
+    # Count the pipeline stages ("simple" or "reasoned") that never ran because the client went away
+    def skip_stages(self, models):
+        for model in models:
+            self.llm_integration.savings.skipped(self.llm_integration.reasoned_model if model == "reasoned" else self.llm_integration.simple_model)
+
+    # Asyncio versions for the ASGI entry point (see asgi.py)
+    async def aget_reasoned_response(self, user_input, use_cache=True, schedule=None, cancel=None):
+        processed_input = self.preprocess_input(user_input)
+        return await self.llm_integration.agenerate_reasoned_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel)
+
+    async def aget_simple_response(self, user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None):
+        processed_input = self.preprocess_input(user_input)
+        return await self.llm_integration.agenerate_simple_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel, **self.session_options(session, chunks))
+
+    def astream_reasoned_response(self, user_input, use_cache=True, schedule=None, cancel=None):
+        processed_input = self.preprocess_input(user_input)
+        return self.llm_integration.astream_reasoned_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel)
+
+    def astream_simple_response(self, user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None):
+        processed_input = self.preprocess_input(user_input)
+        return self.llm_integration.astream_simple_response(processed_input, use_cache=use_cache, schedule=schedule, cancel=cancel, **self.session_options(session, chunks))
+
+    # Send the conversation's cached context and store the one Ollama returns, along with the chunks it now contains
+    def session_options(self, session, chunks=()):
+        if session is None:
+            return {}
+        def on_done(result):
+            self.contexts.put(session, result.get("context"), chunks)
+        return {"context": self.contexts.get(session), "on_done": on_done}
+
+    # The excerpt goes before the question so a turn's prompt extends the previous context instead of rewriting it,
+    # and chunks already in that context are not sent again
+    def build_context_prompt(self, label, chunk_index, name, user_input, session=None):
+        sent = self.contexts.chunks(session) if session is not None else frozenset()
+        with STAGE_SECONDS.time(stage="retrieval"):
+            new = [i for i in chunk_index.select(name, user_input) if i not in sent]
+        if not new:
+            return user_input, sent
+        return f"{label}:\n{chunk_index.render(name, new)}\n\n{user_input}", sent.union(new)
+
+    def add_document(self, filename, text):
+        self.documents[filename] = text
+        self.index_document(filename)
+
+    # Called when an ingestion job has streamed the text to the document's staging file
+    def add_extracted_document(self, filename, chars):
+        self.documents.register(filename)
+        self.index_document(filename)
+
+    # Called when an ingestion job could not extract the text; the upload is deleted instead of being listed
+    def discard_document(self, filename, error):
+        print(f"Discarding {filename}: {error}")
+        self.documents.discard(filename)
+        self.document_chunks.remove(filename)
+        self.contexts.discard_if(lambda session: session[1] == filename)
+
+    def add_link(self, filename, text):
+        self.links[filename] = text
+        self.index_link(filename)
+
+    # Return only the chunks of a document that are relevant to the query
+    def get_document_context(self, filename, query):
+        self.index_document(filename)
+        return self.document_chunks.retrieve(filename, query)
+
+    def get_link_context(self, filename, query):
+        self.index_link(filename)
+        return self.link_chunks.retrieve(filename, query)
+
+    # Prompt for a question about a document, and the chunk ids the conversation's context will then hold
+    def get_document_prompt(self, filename, user_input, session=None):
+        self.index_document(filename)
+        return self.build_context_prompt("Document Content", self.document_chunks, filename, user_input, session)
+
+    def get_link_prompt(self, filename, user_input, session=None):
+        self.index_link(filename)
+        return self.build_context_prompt("Link Content", self.link_chunks, filename, user_input, session)
+
+    # Input for the reasoning pipeline with the excerpts of the selected document and link. The reasoner does not
+    # continue the conversation's context, so every selected chunk is sent again
+    def get_reasoning_prompt(self, document_name, link, user_input):
+        if document_name and link:
+            excerpts = f"Document Content:\n{self.get_document_context(document_name, user_input)}\n\nLink Content:\n{self.get_link_context(link, user_input)}"
+            return f"{excerpts}\n\n{user_input}", ()                            # Chunk ids of two sources cannot share one set
+        if document_name:
+            return self.get_document_prompt(document_name, user_input)
+        if link:
+            return self.get_link_prompt(link, user_input)
+        return user_input, ()
+
+    # Chunk the stored text again when it was replaced since it was indexed, here or by another worker
+    def index_document(self, filename):
+        generation = self.documents.generation(filename)
+        if self.document_chunks.tag(filename) != generation:
+            if filename in self.document_chunks:
+                self.contexts.discard_if(lambda session: session[1] == filename)
+            self.document_chunks.add_stream(filename, lambda: self.documents.open(filename), generation)
+
+    def index_link(self, filename):
+        generation = self.links.generation(filename)
+        if self.link_chunks.tag(filename) != generation:
+            if filename in self.link_chunks:
+                self.contexts.discard_if(lambda session: session[2] == filename)
+            self.link_chunks.add_stream(filename, lambda: self.links.open(filename), generation)
+
     def extract_text_from_file(self, filepath):
-        ext = filepath.rsplit('.', 1)[1].lower()
-        if ext == 'pdf':
-            return self.extract_text_from_pdf(filepath)
-        elif ext == 'txt':
-            return self.extract_text_from_txt(filepath)
-        elif ext == 'json':
-            return self.extract_text_from_json(filepath)
-        elif ext == 'docx':
-            return self.extract_text_from_docx(filepath)
-        return ""
+        return extractors.extract_text_from_file(filepath)
+
+    def extract_document_to_file(self, filepath, output_path):
+        with STAGE_SECONDS.time(stage="extract"):
+            return extractors.extract_to_file(filepath, output_path, MAX_DOCUMENT_CHARS)
 
     def extract_text_from_pdf(self, filepath):
-        text = ""
-        try:
-            with open(filepath, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for page_num in range(len(reader.pages)):
-                    text += reader.pages[page_num].extract_text()
-            return text
-        except FileNotFoundError:
-            return "Error file not found"
-        except Exception as e:
-            return f"Error: {e}"
+        return extractors.extract_text_from_pdf(filepath)
 
     def extract_text_from_txt(self, filepath):
-        try:
-            with open(filepath, 'r') as file:
-                return file.read()
-        except FileNotFoundError:
-            return "Error file not found"
-        except Exception as e:
-            return f"Error: {e}"
+        return extractors.extract_text_from_txt(filepath)
 
     def extract_text_from_json(self, filepath):
-        try:
-            with open(filepath, 'r') as file:
-                data = json.load(file)
-                return json.dumps(data, indent=4)
-        except FileNotFoundError:
-            return "Error file not found"
-        except Exception as e:
-            return f"Error: {e}"
+        return extractors.extract_text_from_json(filepath)
 
     def extract_text_from_docx(self, filepath):
-        try:
-            doc = docx.Document(filepath)
-            return "\n".join([para.text for para in doc.paragraphs])
-        except FileNotFoundError:
-            return "Error file not found"
-        except Exception as e:
-            return f"Error: {e}"
+        return extractors.extract_text_from_docx(filepath)
 
-    def extract_data_from_web_page(self, url):
-        async def get_web_data(url):
-            async with AsyncWebCrawler() as crawler:
-                result = await crawler.arun(url=url)
-                return result.markdown
-        return asyncio.run(get_web_data(url))
+    def read_link_file(self, filepath):
+        with open(filepath, 'r') as file:
+            return json.load(file)
 
-chatbot = Chatbot(api_url="http://localhost:11434/api/generate")
+    def extract_data_from_web_page(self, url):
+        return web_crawler.get().crawl(url)
+
+    def extract_data_from_web_pages(self, urls):
+        return web_crawler.get().crawl_many(urls)
+
+llm_router = LLMRouter(parse_backends(LLM_BACKENDS), LLM_HEALTH_INTERVAL).start() if LLM_BACKENDS else None
+chatbot = Chatbot(api_url="http://localhost:11434/api/generate", router=llm_router)
+print(f"Restored {len(chatbot.documents)} documents and {len(chatbot.links)} links")
+ingestion = IngestionQueue(extractors.extract_to_file, chatbot.add_extracted_document, INGESTION_WORKERS, INGESTION_QUEUE_LIMIT,
+                           on_failure=chatbot.discard_document)
+
+# Summaries for memory compaction wait behind every chat for the simple model
+def summarize_memories(user_texts, bot_texts):
+    turns = "\n".join(f"User: {(user or '')[:500]}\nAssistant: {(bot or '')[:500]}" for user, bot in zip(user_texts, bot_texts))
+    prompt = f"Summarize this part of a conversation in a few sentences. Keep names, facts and decisions.\n\n{turns}"
+    summary = chatbot.llm_integration.generate_simple_response(prompt, use_cache=False, schedule=("memory-compaction", PRIORITY_BACKGROUND))
+    if not summary or summary.startswith("Error"):
+        raise RuntimeError(summary or "Empty summary")
+    return summary
+
+memory_compactor = MemoryCompactor(memory_index.get, memory_collection.get, lambda turns: save_turns(turns),
+                                   summarize_memories if MEMORY_COMPACT_SUMMARIZE else None, MEMORY_MAX_TURNS, MEMORY_TTL,
+                                   MEMORY_COMPACT_AFTER, MEMORY_COMPACT_KEEP, MEMORY_COMPACT_GROUP, MEMORY_COMPACT_INTERVAL)
+if not SPAWNED:
+    memory_compactor.start()
+startup_timer.mark("chatbot")
+
+# Read from the live objects when /metrics is scraped
+REGISTRY.gauge("chatbot_llm_active", "Generations holding a scheduler slot", ("model",),
+               lambda: {model: queue["active"] for model, queue in chatbot.scheduler.stats()["models"].items()})
+REGISTRY.gauge("chatbot_llm_queue_depth", "Generations waiting for a scheduler slot", ("model",),
+               lambda: {model: queue["waiting"] for model, queue in chatbot.scheduler.stats()["models"].items()})
+REGISTRY.gauge("chatbot_ingestion_pending", "Uploads queued or extracting", function=ingestion.pending)
+REGISTRY.gauge("chatbot_memory_recall_pending", "Memory lookups running or queued", function=lambda: memory_recall.pending)
+REGISTRY.gauge("chatbot_cache_entries", "Entries held by each cache", ("cache",),
+               lambda: {"embeddings": embedding_service.cache.stats()["entries"], "contexts": chatbot.contexts.stats()["conversations"],
+                        "responses": chatbot.llm_integration.response_cache.stats()["entries"]})
+REGISTRY.gauge("chatbot_memory_turns", "Conversation turns stored", function=lambda: memory_index.get().count() if memory_index.loaded else 0)
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+# Streams are timed up to their headers; their generations are timed by the LLM metrics
+@app.after_request
+def record_timing(response):
+    if 'started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.started, route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    if 'started' in g:
+        HTTP_IN_FLIGHT.dec()
+
+if WARM_START and not SPAWNED:
+    sentence_model.warm()
+    memory_index.warm()
+startup_timer.report()
+
+# Set once the client of the current request has closed its connection
+def disconnect_token():
+    sock = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    return CancelToken(lambda: peer_closed(sock))
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def stream_stage(stage, tokens, parts):
+    for token in tokens:
+        parts.append(token)
+        yield sse_event({"stage": stage, "token": token})
+
+def stream_simple_chat(user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None):
+    response = []
+    yield from stream_stage("response", chatbot.stream_simple_response(user_input, session, chunks, use_cache, schedule, cancel), response)
+    yield sse_event({"stage": "response", "done": True, "response": "".join(response)})
+
+def stream_reasoned_chat(user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None, question=None):
+    # Every stage is streamed so the client sees tokens while the chain is still running
+    for event in chatbot.pipeline.stream(chatbot, user_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel, question=question):
+        yield sse_event(event)
 
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({"message": "Welcome to the ChatBot API"})
 
+# Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"}), 200
+
+# Ready once every subsystem named in READY_REQUIRES is loaded; plain /chat needs none of them
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    subsystems = {resource.name: resource.status() for resource in (sentence_model, memory_collection, memory_index, web_crawler)}
+    subsystems["documents"] = {"state": "loaded", "listed": len(chatbot.documents), "extracted": chatbot.documents.loaded()}
+    subsystems["links"] = {"state": "loaded", "listed": len(chatbot.links), "extracted": chatbot.links.loaded()}
+    if llm_router is not None:
+        subsystems["llm_backends"] = llm_router.status()
+    ready = all(subsystems.get(name, {}).get("state") == "loaded" for name in READY_REQUIRES)
+    return jsonify({"ready": ready, "subsystems": subsystems}), 200 if ready else 503
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "embeddings": embedding_service.cache.stats(),
+        "contexts": chatbot.contexts.stats(),
+        "responses": chatbot.llm_integration.response_cache.stats(),
+        "documents": chatbot.documents.store.stats(),
+        "links": chatbot.links.store.stats()
+    })
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(chatbot.scheduler.stats())
+
+# Model time saved by stopping generations whose client disconnected
+@app.route('/compute_stats', methods=['GET'])
+def compute_stats():
+    return jsonify(chatbot.llm_integration.savings.stats())
+
+@app.route('/recall_stats', methods=['GET'])
+def recall_stats():
+    return jsonify(memory_recall.stats())
+
+@app.route('/compaction_stats', methods=['GET'])
+def compaction_stats():
+    return jsonify(memory_compactor.stats())
+
 @app.route('/documents', methods=['GET'])
 def list_documents():
     return jsonify({"documents": list(chatbot.documents.keys())})
@@ -139,6 +508,7 @@ def list_documents():
 def list_links():
     return jsonify({"links": list(chatbot.links.keys())})
 
+# Saves the file and returns a job id right away; poll /jobs/<id> to see when the text is ready
 @app.route('/document_upload', methods=['POST'])
 def upload_file():
     try:
@@ -151,19 +521,25 @@ def upload_file():
             filename = secure_filename(file.filename)
             filepath = os.path.join(app.config['DOCUMENTS_FOLDER'], filename)
             file.save(filepath)
-            # Check if chatbot object is available and functioning
             try:
-                extracted_text = chatbot.extract_text_from_file(filepath)
-                chatbot.documents[filename] = extracted_text
-            except Exception as e:
-                print("Error extracting text:", e)
-                raise e
-            return jsonify({"message": "File uploaded successfully", "filename": filename}), 200
+                job = ingestion.submit(filename, filepath, chatbot.documents.staging_path(filename), MAX_DOCUMENT_CHARS)
+            except IngestionQueueFull as e:
+                return jsonify({"error": str(e)}), 429
+            return jsonify({"message": "File uploaded successfully", "filename": filename, "jobId": job["id"], "status": job["status"]}), 202
         return jsonify({"error": "File type not allowed"}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"File is larger than {MAX_UPLOAD_BYTES} bytes"}), 413
     except Exception as e:
         print(f"Error during file upload: {e}")
         return jsonify({"error": f"Error during file upload: {e}"}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingestion.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
 @app.route('/document_delete', methods=['POST'])
 def delete_document():
     data = request.get_json()
@@ -171,17 +547,32 @@ def delete_document():
     if not filename:
         return jsonify({"response": "Error: No filename provided"}), 400
 
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if not os.path.exists(filepath):
+    # Only names the library lists, so a path like ../chroma/memory_index.db never reaches os.remove
+    if filename != secure_filename(filename):
+        return jsonify({"response": "Error: Invalid filename"}), 400
+    if filename not in chatbot.documents:
         return jsonify({"response": "Error: File not found"}), 404
 
+    filepath = os.path.join(app.config['DOCUMENTS_FOLDER'], filename)
+
     try:
         os.remove(filepath)
         del chatbot.documents[filename]
+        chatbot.document_chunks.remove(filename)
+        chatbot.contexts.discard_if(lambda session: session[1] == filename)
         return jsonify({"response": "File deleted successfully"}), 200
     except Exception as e:
         return jsonify({"response": f"Error: {e}"}), 500
 
+def save_link(url, content):
+    filename = secure_filename(f"{url}.json")
+    filepath = os.path.join(app.config['LINKS_FOLDER'], filename)
+    with open(filepath, 'w') as file:
+        json.dump(content, file)
+    chatbot.add_link(filename, content)
+    return filename
+
+# Accepts one URL as a string, or a list of URLs that are crawled concurrently
 @app.route('/link_upload', methods=['POST'])
 def crawl():
     data = request.get_json()
@@ -189,20 +580,35 @@ def crawl():
     if not urls:
         return jsonify({"response": "Error: Empty input"}), 400
 
-    try:
-        response = chatbot.extract_data_from_web_page(urls)
-        if response:
-            filename = secure_filename(f"{urls}.json")
-            filepath = os.path.join(app.config['LINKS_FOLDER'], filename)
-            with open(filepath, 'w') as file:
-                json.dump(response, file)
-            chatbot.links[filename] = response
+    if isinstance(urls, str):
+        try:
+            response = chatbot.extract_data_from_web_page(urls)
+            save_link(urls, response)
             return jsonify({"response": response}), 200
-        else:
-            return jsonify({"response": "Error: Unable to extract data"}), 500
+        except Exception as e:
+            return jsonify({"response": f"Error: {e}"}), 500
+
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return jsonify({"response": "Error: urls must be a string or a list of strings"}), 400
+    if len(urls) > LINK_UPLOAD_LIMIT:
+        return jsonify({"response": f"Error: Too many URLs, the limit is {LINK_UPLOAD_LIMIT}"}), 413
+
+    try:
+        crawled = chatbot.extract_data_from_web_pages(list(dict.fromkeys(urls)))
     except Exception as e:
         return jsonify({"response": f"Error: {e}"}), 500
 
+    results = []
+    for url, content in crawled:
+        if isinstance(content, BaseException):
+            results.append({"url": url, "error": f"Error: {content}"})
+            continue
+        try:
+            results.append({"url": url, "filename": save_link(url, content), "response": content})
+        except Exception as e:
+            results.append({"url": url, "error": f"Error: {e}"})
+    return jsonify({"results": results}), 200
+
 @app.route('/link_delete', methods=['POST'])
 def delete_link():
     data = request.get_json()
@@ -210,82 +616,164 @@ def delete_link():
     if not filename:
         return jsonify({"response": "Error: No filename provided"}), 400
 
-    filepath = os.path.join(app.config['LINKS_FOLDER'], filename)
-    if not os.path.exists(filepath):
+    if filename != secure_filename(filename):
+        return jsonify({"response": "Error: Invalid filename"}), 400
+    if filename not in chatbot.links:
         return jsonify({"response": "Error: File not found"}), 404
 
+    filepath = os.path.join(app.config['LINKS_FOLDER'], filename)
+
     try:
         os.remove(filepath)
         del chatbot.links[filename]
+        chatbot.link_chunks.remove(filename)
+        chatbot.contexts.discard_if(lambda session: session[2] == filename)
         return jsonify({"response": "File deleted successfully"}), 200
     except Exception as e:
         return jsonify({"response": f"Error: {e}"}), 500
 
+def build_memory_metadata(data, timestamp):
+    # Create a unified metadata structure with a timestamp
+    return {
+        "userMessage": data.get('userMessage'),
+        "botMessage": data.get('botMessage'),
+        "documents": data.get('documents', []),
+        "links": data.get('links', []),
+        "timestamp": timestamp,
+        "conversationId": data.get('conversationId')
+    }
+
+# (role, text) of every text of a turn that gets a vector
+def memory_texts(metadata):
+    texts = []
+    if metadata["userMessage"]:
+        texts.append(("user", metadata["userMessage"]['text']))
+    if metadata["botMessage"]:
+        texts.append(("bot", metadata["botMessage"]['text']))
+    texts.extend(("document", name) for name in metadata["documents"] or [])
+    texts.extend(("link", name) for name in metadata["links"] or [])
+    return texts
+
+def memory_role(metadata, text):
+    for role, candidate in memory_texts(metadata):
+        if candidate == text:
+            return role
+    return "user"
+
+# Vectors only carry what filtering and ranking need; the turn itself is read from the memory index
+def vector_metadata(metadata, turn_id, role):
+    return {"conversation_id": metadata.get("conversationId"), "turn_id": turn_id, "role": role,
+            "timestamp": to_epoch(metadata.get("timestamp"))}
+
+def upsert_memory_records(records, collection=None):
+    # Chroma rejects duplicate ids within one upsert, and the last write wins when they are sent one by one
+    unique = {}
+    for record in records:
+        unique[record["id"]] = record
+    records = list(unique.values())
+
+    failed = {}
+    for start in range(0, len(records), UPSERT_BATCH_SIZE):
+        batch = records[start:start + UPSERT_BATCH_SIZE]
+        try:
+            with STAGE_SECONDS.time(stage="chroma_upsert"):
+                (collection or get_collection()).upsert(
+                    documents=[record["text"] for record in batch],
+                    metadatas=[record["metadata"] for record in batch],
+                    embeddings=[record["embedding"] for record in batch],
+                    ids=[record["id"] for record in batch]
+                )
+        except Exception as e:
+            for record in batch:
+                failed[record["item"]] = str(e)
+    return failed
+
+# Store turns built by build_memory_metadata; returns {position in turns: error} for the ones that failed
+def save_turns(turns):
+    index = memory_index.get()                                                  # Opened first, so a migration cannot pick up these turns as well
+    texts = []
+    owners = []
+    for position, metadata in enumerate(turns):
+        turn_id = uuid.uuid4().hex
+        for role, text in memory_texts(metadata):
+            texts.append(text)
+            owners.append((position, turn_id, role))
+
+    # Every text goes through the transformer in a single batched call
+    vectors = embedding_service.encode(texts).tolist() if texts else []
+    records = []
+    rows = {}
+    for text, vector, (position, turn_id, role) in zip(texts, vectors, owners):
+        metadata = turns[position]
+        records.append({"id": memory_id(metadata["conversationId"], text),
+                        "text": text,
+                        "embedding": vector,
+                        "metadata": vector_metadata(metadata, turn_id, role),
+                        "item": position})
+        rows[position] = (turn_id, metadata["conversationId"], metadata["timestamp"], json.dumps(metadata, separators=(',', ':')))
+
+    failed = upsert_memory_records(records)
+    index.add_many(row for position, row in rows.items() if position not in failed)
+    return failed
+
 @app.route('/store_memory', methods=['POST'])
 def store_memory():
     data = request.get_json()
-    user_message = data.get('userMessage')
-    bot_message = data.get('botMessage')
-    documents = data.get('documents', [])
-    links = data.get('links', [])
-    conversation_id = data.get('conversationId')
 
-    if not user_message and not bot_message:
+    if not data.get('userMessage') and not data.get('botMessage'):
         return jsonify({"error": "No message provided"}), 400
 
-    # Create a unified metadata structure with a timestamp
-    metadata = {
-        "userMessage": user_message,
-        "botMessage": bot_message,
-        "documents": documents,
-        "links": links,
-        "timestamp": datetime.utcnow().isoformat(),
-        "conversationId": conversation_id
-    }
-
-    metadata_json = json.dumps(metadata)
-
-    embeddings = []
-    if user_message:
-        user_embedding = sentence_model.encode(user_message['text']).tolist()
-        embeddings.append({"text": user_message['text'], 
-                           "embedding": user_embedding, 
-                           "metadata": metadata_json,
-                           "conversation_id": conversation_id})
-   
-    if bot_message:
-        bot_embedding = sentence_model.encode(bot_message['text']).tolist()
-        embeddings.append({"text": bot_message['text'], 
-                           "embedding": bot_embedding, 
-                           "metadata": metadata_json,
-                           "conversation_id": conversation_id})
-    
-    if documents:
-        for doc in documents:
-            doc_embedding = sentence_model.encode(doc).tolist()
-            embeddings.append({"text": doc, 
-                               "embedding": doc_embedding, 
-                               "metadata": metadata_json,
-                               "conversation_id": conversation_id})
-    
-    if links:
-        for link in links:
-            link_embedding = sentence_model.encode(link).tolist()
-            embeddings.append({"text": link, 
-                               "embedding": link_embedding, 
-                               "metadata": metadata_json,
-                               "conversation_id": conversation_id})
-
-    for embedding in embeddings:
-        collection.upsert(
-            documents=[embedding["text"]],
-            metadatas=[{"metadata": embedding["metadata"], "conversation_id": embedding["conversation_id"]}],
-            embeddings=[embedding["embedding"]],
-            ids=[embedding["text"]]
-        )
+    metadata = build_memory_metadata(data, datetime.utcnow().isoformat())
+    failed = save_turns([metadata])
+    if failed:
+        return jsonify({"error": f"Error storing memory: {failed[0]}"}), 500
 
     return jsonify({"message": "Memory stored successfully", "metadata": metadata}), 200
-    
+
+@app.route('/store_memory_bulk', methods=['POST'])
+def store_memory_bulk():
+    data = request.get_json()
+    items = data.get('memories')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "No memories provided"}), 400
+    if len(items) > BULK_MEMORY_LIMIT:
+        return jsonify({"error": f"Too many memories, the limit is {BULK_MEMORY_LIMIT}"}), 413
+
+    results = []
+    turns = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or (not item.get('userMessage') and not item.get('botMessage')):
+            results.append({"index": index, "error": "No message provided"})
+            continue
+        # Imported history keeps its original timestamps so latest-memory ordering stays correct
+        metadata = build_memory_metadata(item, item.get('timestamp') or datetime.utcnow().isoformat())
+        results.append({"index": index, "stored": len(memory_texts(metadata)), "turn": len(turns)})
+        turns.append(metadata)
+
+    failed = save_turns(turns)
+    for result in results:
+        turn = result.pop("turn", None)
+        if turn in failed:
+            result.pop("stored")
+            result["error"] = f"Error storing memory: {failed[turn]}"
+
+    stored = sum(1 for result in results if "stored" in result)
+    return jsonify({"message": f"Stored {stored} of {len(items)} memories", "results": results}), 200
+
+# Compact now instead of waiting for the background run; with a conversationId only that conversation
+@app.route('/compact_memory', methods=['POST'])
+def compact_memory():
+    data = request.get_json(silent=True) or {}
+    memory_compactor.run(data.get('conversationId'))
+    return jsonify(memory_compactor.stats()), 200
+
+def memory_limit(data, default):
+    try:
+        return max(1, min(int(data.get('limit', default)), MEMORY_PAGE_LIMIT))
+    except (TypeError, ValueError):
+        return default
+
+# Conversation history, newest first; pass the returned nextCursor to get the following page
 @app.route('/retrieve_memory', methods=['POST'])
 def retrieve_memory():
     data = request.get_json()
@@ -294,27 +782,12 @@ def retrieve_memory():
     if not conversation_id:
         return jsonify({"error": "No conversation ID provided"}), 400
 
-    results = collection.query(
-        query_texts=[""],
-        n_results=100,
-        where={"conversation_id": conversation_id}
-    )
-
-    memories = []
-    documents = results.get("documents", [])
-    metadatas = results.get("metadatas", [])
-
-    for metadata_item, doc in zip(metadatas, documents):
-        metadata = metadata_item[0] if isinstance(metadata_item, list) else metadata_item
-
-        try:
-            metadata_json = json.loads(metadata.get("metadata", "{}"))
-        except Exception:
-            metadata_json = {}
-
-        memories.append(metadata_json)
+    try:
+        memories, next_cursor = memory_index.get().page(conversation_id, memory_limit(data, 100), data.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify({"memories": memories}), 200
+    return jsonify({"memories": memories, "nextCursor": next_cursor}), 200
 
 @app.route('/retrieve_latest_memory', methods=['POST'])
 def retrieve_latest_memory():
@@ -324,36 +797,7 @@ def retrieve_latest_memory():
     if not conversation_id:
         return jsonify({"error": "No conversation ID provided"}), 400
 
-    results = collection.query(
-        query_texts=[""],
-        n_results=100,
-        where={"conversation_id": conversation_id}
-    )
-
-    memories = []
-    documents = results.get("documents", [])
-    metadatas = results.get("metadatas", [])
-
-    for metadata_item, doc in zip(metadatas, documents):
-        metadata = metadata_item[0] if isinstance(metadata_item, list) else metadata_item
-
-        try:
-            metadata_json = json.loads(metadata.get("metadata", "{}"))
-        except Exception:
-            metadata_json = {}
-        
-        timestamp_str = metadata_json.get("timestamp", "")
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str).replace(tzinfo=None)
-        except ValueError:
-            timestamp = datetime.min.replace(tzinfo=None)
-        metadata_json["timestamp"] = timestamp
-
-        memories.append(metadata_json)
-
-    memories = sorted(memories, key=lambda x: x.get("timestamp", datetime.min), reverse=True)
-
-    recent_memories = memories[:5]
+    recent_memories = memory_index.get().latest(conversation_id, memory_limit(data, LATEST_MEMORY_LIMIT))
 
     return jsonify({"memories": recent_memories}), 200
 
@@ -364,7 +808,9 @@ def chat():
     document_name = data.get('document')
     link = data.get('link')
     memories = data.get('memories')
-    relevant_memories = []
+    stream = data.get('stream')
+    conversation_id = data.get('conversationId')
+    use_cache = data.get('cache', True) is not False                            # "cache": false always generates a fresh response
 
     if not user_input:
         return jsonify({'response': 'Error: Empty input'})
@@ -375,9 +821,18 @@ def chat():
     if not isinstance(user_input, str):
         return jsonify({'response': 'Error: Invalid input type'})
     
+    try:
+        schedule = chatbot.admit(conversation_id, data.get('reasoning'))
+    except SchedulerBusy as e:
+        return jsonify({'response': f'Error: {e}'}), 429, {'Retry-After': str(e.retry_after)}
+
+    cancel = disconnect_token()                                                 # Stops the generation if the client goes away
+
     if user_input.lower() == '/bye':
         formatted_inquiry = f"Am trying to say goodbye to you. Please wish me well."
-        simple_response = chatbot.get_simple_response(formatted_inquiry)
+        if stream:
+            return sse_response(stream_simple_chat(formatted_inquiry, use_cache=use_cache, schedule=schedule, cancel=cancel))
+        simple_response = chatbot.get_simple_response(formatted_inquiry, use_cache=use_cache, schedule=schedule, cancel=cancel)
         return jsonify({'response': simple_response})
         exit()
 
@@ -385,91 +840,60 @@ def chat():
         for memory in memories:
             print(f"Memory: {memory}")
 
+    # Earlier turns of the conversation similar to this message, if they can be found within the budget
+    relevant_memories = memory_recall.recall(user_input, conversation_id)
     if relevant_memories:
-        memories_input = f"{user_input}\n\n{' '.join(str(relevant_memories))}"
+        memories_input = f"{user_input}\n\n{format_memories(relevant_memories)}"
         print(f"Relevant memories: {memories_input}")
     else:
         memories_input = user_input
 
+    # Follow-up turns of a conversation continue from the Ollama context of the previous one
+    session = (str(conversation_id), document_name, link) if conversation_id is not None else None
+
     try:
         if data.get('reasoning'):
+            if document_name and document_name not in chatbot.documents:
+                return jsonify({'response': 'Error: Document not found'})
+            if link and link not in chatbot.links:
+                return jsonify({'response': 'Error: Link not found'})
+            reasoning_input, chunks = chatbot.get_reasoning_prompt(document_name, link, memories_input)
+            if stream:
+                return sse_response(stream_reasoned_chat(reasoning_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel, question=user_input))
             try:
-                simple_response = chatbot.get_simple_response(memories_input)
-                deepseek_input = f"Our client is requesting about this: {simple_response}"
-                reasoned_response = chatbot.get_reasoned_response(deepseek_input)
-                deepseek_output = f"Here is the relevant reasoned response: {reasoned_response}"
-                final_response = chatbot.get_simple_response(deepseek_output)
-                return jsonify({'response': final_response})
+                final_response, timings = chatbot.pipeline.run(chatbot, reasoning_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel, question=user_input)
+                return jsonify({'response': final_response, 'timings': timings})
             except Exception as e:
                 return jsonify({'response': f'Error): {e}'})
         elif document_name:
             if document_name in chatbot.documents:
                 try:
-                    doc_content = chatbot.documents[document_name]
-                    combined_input = f"{memories_input}\n\nDocument Content:\n{doc_content}"
-                    response = chatbot.get_simple_response(combined_input)
+                    combined_input, chunks = chatbot.get_document_prompt(document_name, memories_input, session)
+                    if stream:
+                        return sse_response(stream_simple_chat(combined_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel))
+                    response = chatbot.get_simple_response(combined_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel)
                     return jsonify({'response': response})
                 except Exception as e:
                     return jsonify({'response': f'Error: {e}'})
             else:
                 return jsonify({'response': 'Error: Document not found'})
-        elif data.get('reasoning') and document_name:
-            if document_name in chatbot.documents:
-                try:
-                    doc_content = chatbot.documents[document_name]
-                    combined_input = f"{memories_input}\n\nDocument Content:\n{doc_content}"
-                    deepseek_input = f"Our client is requesting about this: {combined_input}"
-                    reasoned_response = chatbot.get_reasoned_response(deepseek_input)
-                    deepseek_output = f"Here is the relevant reasoned response: {reasoned_response}"
-                    final_response = chatbot.get_simple_response(deepseek_output)
-                    return jsonify({'response': final_response})
-                except Exception as e:
-                    return jsonify({'response': f'Error: {e}'})
-            else:
-                return jsonify({'response': 'Error: Document not found'})
         elif link:
             if link in chatbot.links:
                 try:
-                    link_content = chatbot.links[link]
-                    combined_input = f"{memories_input}\n\nLink Content:\n{link_content}"
-                    response = chatbot.get_simple_response(combined_input)
+                    combined_input, chunks = chatbot.get_link_prompt(link, memories_input, session)
+                    if stream:
+                        return sse_response(stream_simple_chat(combined_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel))
+                    response = chatbot.get_simple_response(combined_input, session, chunks, use_cache=use_cache, schedule=schedule, cancel=cancel)
                     return jsonify({'response': response})
                 except Exception as e:
                     return jsonify({'response': f'Error: {e}'})
             else:
                 return jsonify({'response': 'Error: Link not found'})
-        elif data.get('reasoning') and link:
-            if link in chatbot.links:
-                try:
-                    link_content = chatbot.links[link]
-                    combined_input = f"{memories_input}\n\nLink Content:\n{link_content}"
-                    deepseek_input = f"Our client is requesting about this: {combined_input}"
-                    reasoned_response = chatbot.get_reasoned_response(deepseek_input)
-                    deepseek_output = f"Here is the relevant reasoned response: {reasoned_response}"
-                    final_response = chatbot.get_simple_response(deepseek_output)
-                    return jsonify({'response': final_response})
-                except Exception as e:
-                    return jsonify({'response': f'Error: {e}'})
-            else:
-                return jsonify({'response': 'Error: Link not found'})
-        elif data.get('reasoning') and document_name and link:
-            if document_name in chatbot.documents and link in chatbot.links:
-                try:
-                    doc_content = chatbot.documents[document_name]
-                    link_content = chatbot.links[link]
-                    combined_input = f"{memories_input}\n\nDocument Content:\n{doc_content}\n\nLink Content:\n{link_content}"
-                    deepseek_input = f"Our client is requesting about this: {combined_input}"
-                    reasoned_response = chatbot.get_reasoned_response(deepseek_input)
-                    deepseek_output = f"Here is the relevant reasoned response: {reasoned_response}"
-                    final_response = chatbot.get_simple_response(deepseek_output)
-                    return jsonify({'response': final_response})
-                except Exception as e:
-                    return jsonify({'response': f'Error: {e}'})
-            else:
-                return jsonify({'response': 'Error: Document or link not found'})
         else:
+            if stream:
+                return sse_response(stream_simple_chat(memories_input, session, use_cache=use_cache, schedule=schedule, cancel=cancel))
             try:
-                simple_response = chatbot.get_simple_response(memories_input)
+                simple_response = chatbot.get_simple_response(memories_input, session, use_cache=use_cache, schedule=schedule, cancel=cancel)
                 return jsonify({'response': simple_response})
             except Exception as e:
                 return jsonify({'response': f'Error: {e}'})
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+
+import xxhash
+
+from src.app.metrics import STAGE_SECONDS
+
+'''
+This module keeps the stored conversation memories bounded: it deduplicates, compacts and expires them.
+
+Every text of a turn is stored in Chroma under memory_id(conversation_id, text), a hash of the conversation and
+the text. Storing the same text again in a conversation updates one vector instead of adding another, and equal
+texts in different conversations no longer overwrite each other.
+
+MemoryCompactor runs in the background every interval seconds and works from the turns in the MemoryIndex:
+- Turns older than ttl seconds are removed (0 keeps them forever).
+- A conversation with more than compact_after turns keeps its newest keep_recent turns as they are. The older
+  ones are merged in groups of group_size into one summary turn, which is stored like any other turn and takes
+  the timestamp of the newest turn it replaces. Then the originals are removed. With a summarize function the
+  bot side of the summary is written by the LLM; otherwise, or when the LLM fails, the texts are joined.
+- A conversation that still has more than max_turns turns loses its oldest ones.
+Removing a turn deletes its vectors (those that still carry its turn id) and its index row, so the Chroma
+collection, and with it ANN query time, grows with the number of conversations instead of the number of turns.
+
+Example usage:
+compactor = MemoryCompactor(memory_index.get, memory_collection.get, save_turns, max_turns=1000, ttl=90 * 86400).start()
+compactor.run()                                                                 # compact now instead of waiting
+print(compactor.stats())
+'''
+
+def memory_id(conversation_id, text):
+    return xxhash.xxh3_128_hexdigest(f"{conversation_id}\x00{text}")
+
+def merge_texts(texts, max_chars):
+    text = "\n".join(text for text in texts if text)
+    return text[:max_chars]
+
+class MemoryCompactor:
+    def __init__(self, index, collection, save, summarize=None, max_turns=1000, ttl=0, compact_after=200,
+                 keep_recent=50, group_size=10, interval=300, max_chars=4000):
+        self.index = index                                                      # Returns the MemoryIndex
+        self.collection = collection                                            # Returns the Chroma collection
+        self.save = save                                                        # Stores a list of turn metadata, returns {position: error}
+        self.summarize = summarize                                              # Optional: texts of a group -> summary text
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.compact_after = compact_after
+        self.keep_recent = keep_recent
+        self.group_size = group_size
+        self.interval = interval
+        self.max_chars = max_chars                                              # Longest merged text in a summary turn
+        self.lock = threading.Lock()                                            # One run at a time
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name="memory-compaction", daemon=True)
+        self.runs = 0
+        self.expired = 0
+        self.compacted = 0
+        self.summaries = 0
+        self.capped = 0
+        self.failed = 0
+        self.last_run_ms = 0.0
+
+    def start(self):
+        if self.interval > 0:
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                self.failed += 1
+                print(f"Memory compaction failed: {e}")
+
+    def run(self, conversation_id=None):
+        with self.lock, STAGE_SECONDS.time(stage="memory_compaction"):
+            started = time.perf_counter()
+            index = self.index()
+            if self.ttl > 0 and conversation_id is None:
+                self.expire(index, time.time() - self.ttl)
+            if conversation_id is not None:
+                conversations = [(str(conversation_id), index.count(conversation_id))]
+            else:
+                conversations = index.conversations_over(min(self.compact_after, self.max_turns))
+            for conversation, count in conversations:
+                if count > self.compact_after:
+                    self.compact(index, conversation, count)
+                count = index.count(conversation)
+                if count > self.max_turns:
+                    rows = index.oldest(conversation, count - self.max_turns)
+                    self.forget(index, rows)
+                    self.capped += len(rows)
+            self.runs += 1
+            self.last_run_ms = (time.perf_counter() - started) * 1000
+
+    def expire(self, index, cutoff):
+        while True:
+            rows = index.expired(cutoff)
+            if not rows:
+                return
+            self.forget(index, rows)
+            self.expired += len(rows)
+
+    def compact(self, index, conversation, count):
+        rows = index.oldest(conversation, count - self.keep_recent)
+        for start in range(0, len(rows) - self.group_size + 1, self.group_size):
+            group = rows[start:start + self.group_size]
+            memories = []
+            for _, metadata_json in group:
+                try:
+                    memories.append(json.loads(metadata_json))
+                except ValueError:
+                    memories.append({})
+            failed = self.save([self.summary(memories)])
+            if failed:
+                self.failed += 1
+                print(f"Could not store the summary of {len(group)} turns: {failed[0]}")
+                return
+            self.forget(index, group)
+            self.compacted += len(group)
+            self.summaries += 1
+
+    def summary(self, memories):
+        user_texts = [(memory.get("userMessage") or {}).get("text") for memory in memories]
+        bot_texts = [(memory.get("botMessage") or {}).get("text") for memory in memories]
+        bot_text = None
+        if self.summarize is not None:
+            try:
+                bot_text = self.summarize(user_texts, bot_texts)
+            except Exception as e:
+                print(f"Could not summarize memories, merging them instead: {e}")
+        latest = memories[-1]
+        turns = sum((memory.get("summary") or {}).get("turns", 1) for memory in memories)
+        return {
+            "userMessage": {"text": merge_texts(user_texts, self.max_chars)},
+            "botMessage": {"text": bot_text or merge_texts(bot_texts, self.max_chars)},
+            "documents": sorted({name for memory in memories for name in memory.get("documents") or []}),
+            "links": sorted({name for memory in memories for name in memory.get("links") or []}),
+            "timestamp": latest.get("timestamp"),
+            "conversationId": latest.get("conversationId"),
+            "summary": {"turns": turns, "from": memories[0].get("timestamp"), "to": latest.get("timestamp")}
+        }
+
+    # A vector is only deleted while it still belongs to the removed turn; an identical text stored by a newer
+    # turn has replaced it and stays
+    def forget(self, index, rows, batch_size=100):
+        for start in range(0, len(rows), batch_size):
+            turn_ids = [turn_id for turn_id, _ in rows[start:start + batch_size]]
+            with STAGE_SECONDS.time(stage="chroma_delete"):
+                self.collection().delete(where={"turn_id": {"$in": turn_ids}})
+            index.remove(turn_ids)
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "expired": self.expired,
+            "compacted": self.compacted,
+            "summaries": self.summaries,
+            "capped": self.capped,
+            "failed": self.failed,
+            "last_run_ms": round(self.last_run_ms, 1),
+            "interval": self.interval
+        }
@@ -0,0 +1,219 @@
+import mmap
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+'''
+This module keeps extracted document and link text in one file on disk that every worker process reads through mmap.
+
+ContentStore appends each text to a data file once and records its (offset, length) under its name in an SQLite
+index next to it. Readers map the data file and get a memoryview slice of it, so no text is copied into the
+process: the pages live in the OS page cache and are shared by all workers on the machine. Memory use therefore
+stays flat as workers are added, and text written by one worker is visible to the others right away.
+
+Writes take SQLite's write lock (BEGIN IMMEDIATE), which also serializes writers in other processes. The data is
+appended at the recorded end of the file and the index row is committed after it, so a reader never sees a
+partial text. Replacing or deleting a name leaves its old bytes behind as dead space. Once there are more than
+compact_after dead bytes and they outnumber the live ones, compact() copies the live texts to a new data file and
+switches the index over in one transaction. Every put and delete bumps version(), so other processes can tell that
+names were added or removed, and every entry records the version it was written at as its generation.
+fail(name, signature, error) remembers that a text could not be built from a file, so no worker tries again until
+the file changes; storing or deleting the name forgets the failure.
+
+Example usage:
+store = ContentStore("documents/.content")
+store.put_file("report.pdf", "documents/.extracted/report.pdf.txt", signature="1024:1700000000")
+with store.open("report.pdf") as file:       # file-like reads over the mapped text
+    file.seek(100)
+    print(file.read(50))
+store.delete("report.pdf")
+'''
+
+READ_BLOCK = 1 << 20
+
+class ViewReader:
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(len(self.view), self.position + size)
+        data = self.view[self.position:end].tobytes()
+        self.position = end
+        return data
+
+    def seek(self, position):
+        self.position = position
+
+    def close(self):
+        self.view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ContentStore:
+    def __init__(self, folder, compact_after=64 * 1024 * 1024):
+        self.folder = folder
+        self.compact_after = compact_after                                      # Dead bytes tolerated before the data file is rewritten
+        os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(folder, 'index.db'), check_same_thread=False, timeout=30, isolation_level=None)
+        self.lock = threading.RLock()
+        self.mapped = (None, None)                                              # (data file, mmap); every entry lives in the current file
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                name TEXT PRIMARY KEY,
+                file TEXT,
+                offset INTEGER,
+                length INTEGER,
+                signature TEXT,
+                generation INTEGER)""")
+            self.db.execute("CREATE TABLE IF NOT EXISTS failures (name TEXT PRIMARY KEY, signature TEXT, error TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('file', 'data.0'), ('end', 0), ('dead', 0), ('version', 0)")
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _meta(self, key):
+        return self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _set_meta(self, **values):
+        self.db.executemany("UPDATE meta SET value = ? WHERE key = ?", [(value, key) for key, value in values.items()])
+
+    def _append(self, name, blocks, signature):
+        with self.transaction():
+            file_name, end = self._meta('file'), self._meta('end')
+            path = os.path.join(self.folder, file_name)
+            with open(path, 'ab'):
+                pass
+            # Bytes past the recorded end were left by a writer that failed before committing
+            with open(path, 'r+b') as file:
+                file.seek(end)
+                for block in blocks:
+                    file.write(block)
+                length = file.tell() - end
+            old = self.db.execute("SELECT length FROM entries WHERE name = ?", (name,)).fetchone()
+            version = self._meta('version') + 1
+            self.db.execute("INSERT OR REPLACE INTO entries (name, file, offset, length, signature, generation) VALUES (?, ?, ?, ?, ?, ?)",
+                            (name, file_name, end, length, signature, version))
+            self.db.execute("DELETE FROM failures WHERE name = ?", (name,))
+            self._set_meta(end=end + length, dead=self._meta('dead') + (old[0] if old else 0), version=version)
+        self.maybe_compact()
+
+    def put(self, name, text, signature=None):
+        self._append(name, [text.encode('utf-8')], signature)
+
+    # Copy a UTF-8 text file into the store without reading it into memory
+    def put_file(self, name, path, signature=None):
+        with open(path, 'rb') as file:
+            self._append(name, iter(lambda: file.read(READ_BLOCK), b""), signature)
+
+    def delete(self, name):
+        with self.transaction():
+            self.db.execute("DELETE FROM failures WHERE name = ?", (name,))
+            old = self.db.execute("SELECT length FROM entries WHERE name = ?", (name,)).fetchone()
+            if old is None:
+                return
+            self.db.execute("DELETE FROM entries WHERE name = ?", (name,))
+            self._set_meta(dead=self._meta('dead') + old[0], version=self._meta('version') + 1)
+        self.maybe_compact()
+
+    # (file, offset, length, signature, generation) or None
+    def entry(self, name):
+        with self.lock:
+            return self.db.execute("SELECT file, offset, length, signature, generation FROM entries WHERE name = ?", (name,)).fetchone()
+
+    def signatures(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT name, signature FROM entries").fetchall())
+
+    def fail(self, name, signature, error):
+        with self.transaction():
+            self.db.execute("INSERT OR REPLACE INTO failures (name, signature, error) VALUES (?, ?, ?)", (name, signature, error))
+
+    # (signature, error) of the last failed attempt, or None
+    def failure(self, name):
+        with self.lock:
+            return self.db.execute("SELECT signature, error FROM failures WHERE name = ?", (name,)).fetchone()
+
+    def failures(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT name, signature FROM failures").fetchall())
+
+    def version(self):
+        with self.lock:
+            return self._meta('version')
+
+    def _map(self, file_name, size):
+        with self.lock:
+            current, mapped = self.mapped
+            if current != file_name or len(mapped) < size:
+                with open(os.path.join(self.folder, file_name), 'rb') as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mapped = (file_name, mapped)                               # Views of an older mapping keep it alive until released
+            return mapped
+
+    # Zero-copy view of the UTF-8 bytes stored under name
+    def view(self, name):
+        for attempt in range(2):
+            row = self.entry(name)
+            if row is None:
+                raise KeyError(name)
+            file_name, offset, length = row[:3]
+            if length == 0:
+                return memoryview(b"")
+            try:
+                return memoryview(self._map(file_name, offset + length))[offset:offset + length]
+            except FileNotFoundError:                                           # Compacted by another process in between; look again
+                if attempt:
+                    raise
+
+    def text(self, name):
+        return str(self.view(name), 'utf-8', errors='ignore')
+
+    def open(self, name):
+        return ViewReader(self.view(name))
+
+    def maybe_compact(self):
+        with self.lock:
+            dead, end = self._meta('dead'), self._meta('end')
+        if dead > self.compact_after and dead * 2 > end:
+            self.compact()
+
+    # Copy the live texts to a new data file; offsets change but generations do not
+    def compact(self):
+        with self.transaction():
+            old_file, end = self._meta('file'), self._meta('end')
+            new_file = f"data.{int(old_file.split('.')[1]) + 1}"
+            position = 0
+            moves = []
+            with open(os.path.join(self.folder, new_file), 'wb') as file, memoryview(self._map(old_file, end) if end else b"") as source:
+                for name, offset, length in self.db.execute("SELECT name, offset, length FROM entries ORDER BY offset").fetchall():
+                    file.write(source[offset:offset + length])
+                    moves.append((new_file, position, name))
+                    position += length
+            self.db.executemany("UPDATE entries SET file = ?, offset = ? WHERE name = ?", moves)
+            self._set_meta(file=new_file, end=position, dead=0)
+        try:
+            os.remove(os.path.join(self.folder, old_file))
+        except OSError:
+            pass                                                                # Still mapped by a process on a system that forbids removing it
+
+    def stats(self):
+        with self.lock:
+            count, live = self.db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM entries").fetchone()
+            failed = self.db.execute("SELECT COUNT(*) FROM failures").fetchone()[0]
+            return {"entries": count, "bytes": live, "dead_bytes": self._meta('dead'), "file": self._meta('file'), "failed": failed}
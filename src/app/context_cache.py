@@ -0,0 +1,85 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+'''
+This module keeps the Ollama KV context of each conversation between turns.
+
+Ollama's generate API returns a "context" array: the tokens of the prompt and the response it just produced.
+Sending it back with the next prompt lets the model continue from the cached prefix instead of re-evaluating the
+whole conversation. ContextCache holds one such array per key (the conversation, plus the model and the attached
+document or link), together with the ids of the document chunks that are already part of it, so follow-up prompts
+only carry chunks the model has not seen yet.
+
+Entries are evicted least recently used first once max_entries or max_tokens is exceeded. A context longer than
+max_context_tokens is dropped instead of stored, so the next turn starts a fresh context rather than one Ollama
+would have to truncate.
+
+Example usage:
+contexts = ContextCache(max_tokens=2_000_000)
+contexts.put(("42", "llama3.2:1B"), response_json["context"], chunks={0, 3})
+context = contexts.get(("42", "llama3.2:1B"))            # list of token ids, or None
+'''
+
+class ContextCache:
+    def __init__(self, max_entries=256, max_tokens=2_000_000, max_context_tokens=8192):
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens                                            # Total tokens kept across all conversations
+        self.max_context_tokens = max_context_tokens
+        self.entries = OrderedDict()                                            # key -> (array of token ids, frozenset of chunk ids)
+        self.tokens = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0].tolist()
+
+    # Chunk ids already included in the cached context, empty when the conversation starts fresh
+    def chunks(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[1] if entry is not None else frozenset()
+
+    def put(self, key, context, chunks=()):
+        with self.lock:
+            self._discard(key)
+            if not context or len(context) > self.max_context_tokens:
+                return
+            self.entries[key] = (array('l', context), frozenset(chunks))
+            self.tokens += len(context)
+            while len(self.entries) > self.max_entries or self.tokens > self.max_tokens:
+                self._discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        with self.lock:
+            self._discard(key)
+
+    # Drop every entry whose key matches, e.g. the conversations about a document that was replaced
+    def discard_if(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self._discard(key)
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.tokens -= len(entry[0])
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "conversations": len(self.entries),
+                "tokens": self.tokens,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,76 @@
+import asyncio
+import atexit
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from src.app.metrics import STAGE_SECONDS
+
+'''
+This module keeps one headless browser running for the whole life of the server instead of starting a new one
+for every /link_upload.
+
+CrawlerPool owns a single AsyncWebCrawler on a dedicated event loop thread. Request handlers submit URLs to that
+loop from any thread. At most max_contexts pages are open at once across all requests, and at most per_host of
+them point at the same host, so one slow site cannot take every slot.
+
+Example usage:
+pool = CrawlerPool(AsyncWebCrawler).start()
+markdown = pool.crawl("https://example.com")
+results = pool.crawl_many(["https://example.com", "https://example.org"])   # [(url, markdown or exception), ...]
+'''
+
+class CrawlerPool:
+    def __init__(self, crawler_factory, max_contexts=4, per_host=2, timeout=60):
+        self.crawler_factory = crawler_factory
+        self.max_contexts = max_contexts
+        self.per_host = per_host
+        self.timeout = timeout                                                  # Seconds allowed for a single page
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="crawler-pool", daemon=True)
+        self.crawler = None
+
+    def start(self):
+        self.thread.start()
+        self._submit(self._start()).result()
+        atexit.register(self.close)
+        return self
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _start(self):
+        # Semaphores are created here so they belong to the pool's loop
+        self.contexts = asyncio.Semaphore(self.max_contexts)
+        self.hosts = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        self.crawler = self.crawler_factory()
+        await self.crawler.start()
+
+    async def _crawl(self, url):
+        async with self.hosts[urlparse(url).netloc], self.contexts:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self.crawler.arun(url=url), self.timeout)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="crawl")
+        if not getattr(result, "success", True) or not result.markdown:
+            raise RuntimeError(getattr(result, "error_message", None) or "Unable to extract data")
+        return result.markdown
+
+    async def _crawl_many(self, urls):
+        results = await asyncio.gather(*(self._crawl(url) for url in urls), return_exceptions=True)
+        return list(zip(urls, results))
+
+    def crawl(self, url):
+        return self._submit(self._crawl(url)).result()
+
+    # Crawl URLs concurrently; each result is the page markdown or the exception that URL raised
+    def crawl_many(self, urls):
+        return self._submit(self._crawl_many(urls)).result()
+
+    def close(self):
+        if self.crawler is not None and self.loop.is_running():
+            self._submit(self.crawler.close()).result(timeout=10)
+            self.crawler = None
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,194 @@
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import xxhash
+
+from src.app.startup import LazyResource
+from src.app.metrics import EMBEDDING_BATCH_SIZE, STAGE_SECONDS
+
+'''
+This module puts a micro-batching service in front of the sentence transformer.
+
+Every request handler that needs embeddings calls EmbeddingService.encode, which queues the texts and waits.
+A single worker thread drains the queue and runs one forward pass for everything that arrived within max_wait
+seconds (or as soon as max_batch_size texts are waiting), then hands each caller back its own rows.
+On CPU one batched pass is several times cheaper than the same texts encoded one by one.
+
+An optional EmbeddingCache sits in front of the queue. Texts are keyed by an xxhash of their content, kept in an
+in-memory LRU capped at max_entries, and optionally written to an SQLite file so they survive restarts.
+A string that has been embedded once is never sent through the transformer again.
+
+encode() accepts the same arguments as SentenceTransformer.encode for the cases this app uses: a single string
+returns a vector, a list of strings returns a matrix, and normalize_embeddings=True returns unit-length vectors.
+
+Example usage:
+embedding_service = EmbeddingService(SentenceTransformer('all-MiniLM-L6-v2'), cache=EmbeddingCache(path="embeddings.db"))
+vector = embedding_service.encode("hello world").tolist()
+'''
+
+class EmbeddingCache:
+    def __init__(self, max_entries=10000, path=None, namespace="all-MiniLM-L6-v2"):
+        self.max_entries = max_entries
+        self.namespace = namespace                                              # Part of every key, so switching models never returns stale vectors
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self.db.commit()
+
+    def key(self, text):
+        return xxhash.xxh3_128_hexdigest(f"{self.namespace}\0{text}")
+
+    def _remember(self, key, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # Look up many texts at once; returns a vector or None for each text
+    def get_many(self, texts, count=True):
+        keys = [self.key(text) for text in texts]
+        vectors = []
+        with self.lock:
+            for key in keys:
+                vector = self.entries.get(key)
+                if vector is not None:
+                    self.entries.move_to_end(key)
+                vectors.append(vector)
+
+            missing = [key for key, vector in zip(keys, vectors) if vector is None]
+            stored = {}
+            if missing and self.db is not None:
+                placeholders = ",".join("?" * len(missing))
+                for key, blob in self.db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing):
+                    stored[key] = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, stored[key])
+            vectors = [stored.get(key) if vector is None else vector for key, vector in zip(keys, vectors)]
+
+            if count:
+                self.misses += sum(1 for vector in vectors if vector is None)
+                self.disk_hits += len(stored)
+                self.hits += sum(1 for vector in vectors if vector is not None)
+        return vectors
+
+    def put_many(self, texts, vectors):
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            if self.db is not None:
+                self.db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": self.db is not None
+        }
+
+class EmbeddingService:
+    def __init__(self, model, max_batch_size=64, max_wait=0.005, cache=None):
+        self.model = model                                                      # A SentenceTransformer, or a LazyResource that loads one
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait                                                # Seconds to wait for other callers before flushing a partial batch
+        self.pending = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+
+    def encode(self, texts, normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        if not batch:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        vectors = self.cache.get_many(batch) if self.cache else [None] * len(batch)
+        missing = list(dict.fromkeys(text for text, vector in zip(batch, vectors) if vector is None))
+        if missing:
+            self._ensure_worker()
+            future = Future()
+            self.pending.put((missing, future))
+            found = dict(zip(missing, future.result()))
+            vectors = [found[text] if vector is None else vector for text, vector in zip(batch, vectors)]
+        embeddings = np.stack(vectors)
+
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms == 0, 1, norms)
+        return embeddings[0] if single else embeddings
+
+    def _model(self):
+        return self.model.get() if isinstance(self.model, LazyResource) else self.model
+
+    def _ensure_worker(self):
+        if self.worker is None:
+            with self.worker_lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                    self.worker.start()
+
+    def _collect(self):
+        waiting = [self.pending.get()]
+        size = len(waiting[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            waiting.append(request)
+            size += len(request[0])
+        return waiting
+
+    def _run(self):
+        while True:
+            waiting = self._collect()
+            texts = list(dict.fromkeys(text for batch, _ in waiting for text in batch))
+            try:
+                found = {}
+                if self.cache:
+                    # An earlier batch may have embedded the same strings while these callers were queued
+                    for text, vector in zip(texts, self.cache.get_many(texts, count=False)):
+                        if vector is not None:
+                            found[text] = vector
+                texts = [text for text in texts if text not in found]
+                if texts:
+                    EMBEDDING_BATCH_SIZE.observe(len(texts))
+                    with STAGE_SECONDS.time(stage="embed"):
+                        embeddings = np.asarray(self._model().encode(texts, batch_size=self.max_batch_size), dtype=np.float32)
+                    found.update(zip(texts, embeddings))
+                    if self.cache:
+                        self.cache.put_many(texts, embeddings)
+                    self.batches += 1
+                    self.texts += len(texts)
+            except Exception as e:
+                for _, future in waiting:
+                    future.set_exception(e)
+                continue
+
+            for batch, future in waiting:
+                future.set_result(np.stack([found[text] for text in batch]))
@@ -0,0 +1,106 @@
+import os
+
+'''
+This module holds the text extractors for uploaded documents (PDF, TXT, JSON and DOCX).
+
+The iter_text_from_* functions are generators that yield the text a page, a paragraph or a block at a time, so a
+large file never has to exist as one Python string. extract_to_file streams that output straight to a text file
+and stops with ExtractionTooLarge once max_chars is exceeded, which keeps peak memory fixed whatever the upload size.
+JSON files are streamed as written rather than parsed and re-serialized with indentation.
+
+They are plain module-level functions, not Chatbot methods, so they can be pickled and run in the ingestion
+process pool. The extract_text_from_* functions return the whole text, or an "Error..." string when the file
+cannot be read.
+
+Example usage:
+chars = extract_to_file("documents/report.pdf", "documents/.extracted/report.pdf.txt", max_chars=50_000_000)
+text = extract_text_from_file("documents/notes.txt")
+'''
+
+BLOCK_CHARS = 64 * 1024                                                         # Characters read at a time from text files
+
+class ExtractionTooLarge(Exception):
+    pass
+
+def iter_text_from_file(filepath):
+    ext = filepath.rsplit('.', 1)[1].lower()
+    if ext == 'pdf':
+        return iter_text_from_pdf(filepath)
+    elif ext == 'txt':
+        return iter_text_from_txt(filepath)
+    elif ext == 'json':
+        return iter_text_from_json(filepath)
+    elif ext == 'docx':
+        return iter_text_from_docx(filepath)
+    return iter(())
+
+def iter_text_from_pdf(filepath):
+    import PyPDF2
+    with open(filepath, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+
+def iter_text_from_txt(filepath):
+    with open(filepath, 'r', encoding='utf-8', errors='replace') as file:
+        while True:
+            block = file.read(BLOCK_CHARS)
+            if not block:
+                return
+            yield block
+
+def iter_text_from_json(filepath):
+    # Already text; re-serializing with indent=4 would only inflate it
+    return iter_text_from_txt(filepath)
+
+def iter_text_from_docx(filepath):
+    import docx
+    for para in docx.Document(filepath).paragraphs:
+        yield para.text + "\n"
+
+def limit_text(pieces, max_chars=None):
+    total = 0
+    for piece in pieces:
+        total += len(piece)
+        if max_chars and total > max_chars:
+            raise ExtractionTooLarge(f"Document is larger than {max_chars} characters")
+        yield piece
+
+# Stream the extracted text into output_path and return the number of characters written
+def extract_to_file(filepath, output_path, max_chars=None):
+    temp_path = f"{output_path}.tmp"
+    total = 0
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as output:
+            for piece in limit_text(iter_text_from_file(filepath), max_chars):
+                output.write(piece)
+                total += len(piece)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, output_path)
+    return total
+
+def _extract_text(iter_text, filepath, max_chars=None):
+    try:
+        return "".join(limit_text(iter_text(filepath), max_chars))
+    except FileNotFoundError:
+        return "Error file not found"
+    except Exception as e:
+        return f"Error: {e}"
+
+def extract_text_from_file(filepath, max_chars=None):
+    return _extract_text(iter_text_from_file, filepath, max_chars)
+
+def extract_text_from_pdf(filepath):
+    return _extract_text(iter_text_from_pdf, filepath)
+
+def extract_text_from_txt(filepath):
+    return _extract_text(iter_text_from_txt, filepath)
+
+def extract_text_from_json(filepath):
+    return _extract_text(iter_text_from_json, filepath)
+
+def extract_text_from_docx(filepath):
+    return _extract_text(iter_text_from_docx, filepath)
@@ -0,0 +1,101 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.app.metrics import STAGE_SECONDS
+
+'''
+This module runs document extraction in the background so uploads return immediately.
+
+IngestionQueue submits extraction jobs to a process pool, so parsing large PDFs is not limited by the GIL and does
+not hold a request thread. The workers are spawned rather than forked: the server is already running threads (the
+embedding worker, warm-up, Chroma) by the time the first upload arrives, and forking a multithreaded process can
+leave the children deadlocked on a lock one of those threads held. At most max_pending jobs can be queued or running at once; submit() raises
+IngestionQueueFull beyond that. When a job finishes, on_complete(filename, result) is called on a separate thread
+with whatever extract returned, which is where the document lands in chatbot.documents. A job whose extract
+raises is marked failed with the error, after on_failure(filename, error) has removed what the upload left behind.
+
+Each job can be looked up by id until it is among the oldest of the retained finished jobs.
+
+Example usage:
+ingestion = IngestionQueue(extract_to_file, chatbot.add_extracted_document, max_workers=2, on_failure=chatbot.discard_document)
+job = ingestion.submit("report.pdf", "documents/report.pdf", "documents/.extracted/report.pdf.txt")
+print(ingestion.get(job["id"])["status"])       # queued, running, completed or failed
+'''
+
+class IngestionQueueFull(Exception):
+    pass
+
+class IngestionQueue:
+    def __init__(self, extract, on_complete, max_workers=2, max_pending=32, retain=1000, on_failure=None):
+        self.extract = extract                                                  # Must be a module-level function so it can be pickled
+        self.on_complete = on_complete
+        self.on_failure = on_failure                                            # Only called when extract raises
+        self.max_pending = max_pending
+        self.retain = retain
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.completions = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestion")
+        self.jobs = OrderedDict()
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def pending(self):
+        return len(self.futures)
+
+    # extract(*args) runs in a worker process
+    def submit(self, filename, *args):
+        with self.lock:
+            if len(self.futures) >= self.max_pending:
+                raise IngestionQueueFull(f"Too many uploads in progress, the limit is {self.max_pending}")
+            job = {"id": uuid.uuid4().hex, "filename": filename, "status": "queued", "submitted": time.time()}
+            self.jobs[job["id"]] = job
+            future = self.executor.submit(self.extract, *args)
+            self.futures[job["id"]] = future
+        # Completion work (chunking, embedding) runs off the process pool's management thread
+        future.add_done_callback(lambda future: self.completions.submit(self._finish, job["id"], future))
+        return dict(job)
+
+    def _finish(self, job_id, future):
+        job = self.jobs[job_id]
+        try:
+            result = future.result()
+        except Exception as e:
+            if self.on_failure is not None:
+                try:
+                    self.on_failure(job["filename"], e)
+                except Exception as cleanup_error:
+                    print(f"Could not clean up after the failed upload of {job['filename']}: {cleanup_error}")
+            job["status"] = "failed"
+            job["error"] = f"Error: {e}"
+        else:
+            try:
+                self.on_complete(job["filename"], result)
+                job["status"] = "completed"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = f"Error: {e}"
+        job["finished"] = time.time()
+        STAGE_SECONDS.observe(job["finished"] - job["submitted"], stage="ingest")
+        with self.lock:
+            del self.futures[job_id]
+            finished = [key for key, entry in self.jobs.items() if "finished" in entry]
+            for key in finished[:max(0, len(finished) - self.retain)]:
+                del self.jobs[key]
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            future = self.futures.get(job_id)
+            job = dict(job)
+        if future is not None and future.running():
+            job["status"] = "running"
+        return job
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.completions.shutdown(wait=False)
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+from collections.abc import MutableMapping
+
+from src.app.content_store import ContentStore
+
+'''
+This module restores uploaded documents and crawled links from their folders after a restart.
+
+DocumentLibrary is a dict-like view of a folder: every file in it is listed right away, but its text is only
+extracted the first time it is needed. The text then goes into a ContentStore (see content_store.py) in the
+folder's hidden .content directory, which is shared by all worker processes and read back through mmap. open(name)
+gives streaming readers zero-copy access, and reading documents[name] decodes the whole text.
+
+extract is called in one of two ways:
+- to_file=True (documents): extract(filepath, output_path) streams the text into staging_path(name), and the file
+  is then copied into the store. Ingestion workers write to the same path and the text is picked up by register().
+- to_file=False (links): extract(filepath) returns the text.
+
+Every stored text records the size and modification time of the file it was built from, so unchanged files are
+never extracted twice and replacing a file invalidates its text. generation(name) changes whenever the text is
+replaced, for caches built from it. A library that finds the store's version changed lists the folder again, so
+files uploaded or deleted through another worker show up in every worker.
+
+A file that cannot be extracted (too large, corrupt) is recorded as failed in the store along with its signature.
+Until the file is replaced, using it raises ExtractionFailed with the original error instead of extracting it
+again in every request and every worker. Errors reading the disk (OSError) are not recorded, as they may pass.
+
+Example usage:
+documents = DocumentLibrary("documents", extract_to_file, extensions={"pdf", "txt"})
+print(list(documents))                      # cheap, nothing is extracted yet
+with documents.open("report.pdf") as file:  # extracted now, or the stored text if the file is unchanged
+    print(file.read(200))
+'''
+
+class ExtractionFailed(Exception):
+    pass
+
+class DocumentLibrary(MutableMapping):
+    def __init__(self, folder, extract, extensions=None, to_file=True):
+        self.folder = folder
+        self.extract = extract
+        self.extensions = extensions
+        self.to_file = to_file
+        self.staging_folder = os.path.join(folder, '.extracted')
+        self.store = ContentStore(os.path.join(folder, '.content'))
+        self.names = set()
+        self.seen_version = None                                                # Store version the listing was made at
+        self.lock = threading.RLock()
+        if to_file:
+            os.makedirs(self.staging_folder, exist_ok=True)
+        self._import_manifest()
+        self.scan()
+
+    # Texts cached by earlier versions as one file each in .extracted, listed in .manifest.json
+    def _import_manifest(self):
+        manifest_path = os.path.join(self.folder, '.manifest.json')
+        try:
+            with open(manifest_path, 'r') as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        for name, entry in manifest.items():
+            try:
+                self.store.put_file(name, self.staging_path(name), "%d:%d" % tuple(entry["signature"]))
+                os.remove(self.staging_path(name))
+            except FileNotFoundError:
+                continue
+        try:
+            os.remove(manifest_path)
+        except FileNotFoundError:
+            pass
+
+    def _signature(self, path):
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def staging_path(self, name):
+        return os.path.join(self.staging_folder, f"{name}.txt")
+
+    # List the files in the folder without reading them, and drop the texts of files that are gone
+    def scan(self):
+        with self.lock:
+            self.seen_version = self.store.version()
+            names = set()
+            for name in os.listdir(self.folder):
+                if name.startswith('.') or not os.path.isfile(os.path.join(self.folder, name)):
+                    continue
+                if self.extensions and name.rsplit('.', 1)[-1].lower() not in self.extensions:
+                    continue
+                names.add(name)
+            self.names = names
+            for name in set(self.store.signatures()) | set(self.store.failures()):
+                if name not in names:
+                    self.store.delete(name)
+
+    def refresh(self):
+        if self.store.version() != self.seen_version:
+            self.scan()
+
+    def _is_current(self, name):
+        entry = self.store.entry(name)
+        return entry is not None and entry[3] == self._signature(os.path.join(self.folder, name))
+
+    # Extract the file into the store if it is new or has changed
+    def ensure(self, name):
+        with self.lock:
+            if name not in self:
+                raise KeyError(name)
+            if self._is_current(name):
+                return
+            filepath = os.path.join(self.folder, name)
+            signature = self._signature(filepath)                               # Taken first, so a file replaced meanwhile is extracted again
+            failure = self.store.failure(name)
+            if failure is not None and failure[0] == signature:
+                raise ExtractionFailed(failure[1])
+            try:
+                if self.to_file:
+                    path = f"{self.staging_path(name)}.{os.getpid()}"           # Another worker may be extracting the same file
+                    self.extract(filepath, path)
+                    self._store_staged(name, signature, path)
+                else:
+                    self.store.put(name, self.extract(filepath), signature)
+            except OSError:
+                raise
+            except Exception as e:
+                self.store.fail(name, signature, str(e))
+                raise ExtractionFailed(str(e)) from e
+
+    def _store_staged(self, name, signature, path):
+        self.store.put_file(name, path, signature)
+        os.remove(path)
+
+    # Store a file whose text was already written to staging_path(name), e.g. by the ingestion workers
+    def register(self, name):
+        with self.lock:
+            self._store_staged(name, self._signature(os.path.join(self.folder, name)), self.staging_path(name))
+            self.names.add(name)
+
+    # Remove a file whose text could not be extracted, so it is not listed again after a restart or rescan
+    def discard(self, name):
+        with self.lock:
+            for path in (os.path.join(self.folder, name), self.staging_path(name)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            del self[name]
+
+    def open(self, name):
+        self.ensure(name)
+        return self.store.open(name)
+
+    def generation(self, name):
+        self.ensure(name)
+        return self.store.entry(name)[4]
+
+    def loaded(self):
+        return self.store.stats()["entries"]
+
+    def __getitem__(self, name):
+        self.ensure(name)
+        return self.store.text(name)
+
+    def __setitem__(self, name, text):
+        with self.lock:
+            self.store.put(name, text, self._signature(os.path.join(self.folder, name)))
+            self.names.add(name)
+
+    def __delitem__(self, name):
+        with self.lock:
+            self.names.discard(name)
+            self.store.delete(name)
+
+    def __contains__(self, name):
+        self.refresh()
+        return name in self.names
+
+    def __iter__(self):
+        self.refresh()
+        return iter(list(self.names))
+
+    def __len__(self):
+        self.refresh()
+        return len(self.names)
@@ -0,0 +1,144 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+'''
+This module provides the HTTP client layer that LLMIntegration uses to talk to the Ollama API.
+LLMClient is the synchronous client built on a pooled requests.Session, and AsyncLLMClient is its asyncio twin built on httpx.
+
+Both clients share the same policy:
+- connections are kept alive and reused from a bounded pool,
+- every request gets a (connect, read) timeout picked by model name,
+- with max_concurrency set, at most that many requests are in flight at once and extra callers wait for a slot,
+- connection errors and 429/502/503/504 answers are retried with jittered exponential backoff.
+Read timeouts are not retried, since a generation that stalled once will most likely stall again.
+
+LLMIntegration leaves max_concurrency unset and sizes the pool from its LLMScheduler, so requests only ever wait
+in the scheduler, where they are prioritized and counted. With several backends it also turns retries off
+(max_retries=0), so a failing backend is left to LLMRouter instead of being retried.
+
+Example usage:
+client = LLMClient(timeouts={"deepseek-r1:1.5b": (3.05, 600)})
+response = client.post("http://localhost:11434/api/generate", {"model": "llama3.2:1B", "prompt": "Hi", "stream": False})
+print(response.json()["response"])
+'''
+
+DEFAULT_TIMEOUT = (3.05, 120)                                                   # (connect, read) seconds for models without an entry below
+DEFAULT_TIMEOUTS = {
+    "llama3.2:1B": (3.05, 120),
+    "deepseek-r1:1.5b": (3.05, 300),                                            # Reasoning models think for a long time before answering
+}
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Shared configuration and retry policy for the sync and async clients
+class _ClientPolicy:
+    def __init__(self, pool_size=10, max_concurrency=None, timeouts=None, max_retries=2, backoff_base=0.25, backoff_max=4.0):
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def timeout_for(self, model):
+        return self.timeouts.get(model, DEFAULT_TIMEOUT)
+
+    def backoff(self, attempt):
+        # Full jitter keeps retrying workers from hammering a recovering server in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def should_retry(self, attempt, status_code=None):
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in RETRY_STATUSES
+
+class LLMClient(_ClientPolicy):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.slots = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency else nullcontext()
+
+    def _send(self, url, data, stream):
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url, json=data, timeout=self.timeout_for(data.get("model")), stream=stream)
+            except requests.exceptions.ConnectionError:
+                if not self.should_retry(attempt):
+                    raise
+            else:
+                if not self.should_retry(attempt, response.status_code):
+                    return response
+                response.close()
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    # Send a request and read the whole body, holding a concurrency slot for the duration
+    def post(self, url, data):
+        with self.slots:
+            return self._send(url, data, stream=False)
+
+    # Send a streaming request; the concurrency slot and connection are released when the block exits
+    @contextmanager
+    def stream(self, url, data):
+        with self.slots:
+            response = self._send(url, data, stream=True)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def close(self):
+        self.session.close()
+
+class AsyncLLMClient(_ClientPolicy):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size))
+        self.slots = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else nullcontext()
+
+    def _timeout(self, model):
+        connect, read = self.timeout_for(model)
+        return httpx.Timeout(read, connect=connect)
+
+    async def _send(self, url, data, stream):
+        attempt = 0
+        while True:
+            request = self.client.build_request("POST", url, json=data, timeout=self._timeout(data.get("model")))
+            try:
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError):
+                if not self.should_retry(attempt):
+                    raise
+            else:
+                if not self.should_retry(attempt, response.status_code):
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def post(self, url, data):
+        async with self.slots:
+            return await self._send(url, data, stream=False)
+
+    @asynccontextmanager
+    async def stream(self, url, data):
+        async with self.slots:
+            response = await self._send(url, data, stream=True)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -1,7 +1,13 @@
 import requests
+import httpx
+import json
 import time
 import asyncio
-from crawl4ai import *
+from contextlib import nullcontext
+from src.app.llm_client import LLMClient, AsyncLLMClient
+from src.app.scheduler import PRIORITY_SIMPLE, SchedulerBusy
+from src.app.cancellation import ComputeSavings
+from src.app import metrics
 
 '''
 This class provides integration with the LLM API for generating responses to user prompts.
@@ -14,6 +20,33 @@ If no URL is provided, the default URL http://localhost:11434/api/generate is us
 To use this class, create an instance of the LLMIntegration class and call the generate_reasoned_response or generate_simple_response method with a prompt as the argument.
 The method will return the generated response as a string.
 
+The stream_reasoned_response and stream_simple_response methods take the same prompt but return a generator
+that yields response tokens as soon as Ollama produces them, instead of waiting for the whole completion.
+
+Requests go through a pooled, timeout-aware LLMClient (see llm_client.py); pass your own client to change pool size,
+timeouts or retries. The default clients hold a connection for every scheduler slot and do not retry when there
+are several backends to fail over to. The methods prefixed with "a" (agenerate_simple_response, astream_simple_response, ...) are the
+asyncio versions and use an AsyncLLMClient, so callers on an event loop never block a thread on the model.
+
+Every method also takes an optional context (the token array Ollama returned for the previous turn) and an
+on_done callback, which receives Ollama's final JSON object with the new context and the timing fields.
+
+With a ResponseCache, finished responses are reused for identical requests and concurrent identical requests share
+one generation (see response_cache.py). Pass use_cache=False to always generate a fresh response.
+
+With an LLMScheduler (see scheduler.py) every request to Ollama first waits for a slot on its model. schedule is
+the (conversation_id, priority) pair the scheduler uses to order the waiting requests.
+
+A CancelToken passed as cancel (see cancellation.py) stops the generation once it is set: the request is streamed
+from Ollama and the upstream response is closed between tokens, so the model stops working on it. The asyncio
+streams check it the same way, while agenerate_* only checks it before starting. Closing a stream generator, or
+cancelling the task running an asyncio call, stops the generation too. self.savings tracks the model time saved
+that way.
+
+With an LLMRouter (see llm_router.py) each request goes to the least loaded healthy backend that serves the model,
+and moves on to the next one when a backend fails before answering. Without one, every request goes to api_url.
+The models used for simple and reasoned responses can be changed with simple_model and reasoned_model.
+
 Example usage:
 llm_integration = LLMIntegration()
 response = llm_integration.generate_reasoned_response("What is the capital of France?")
@@ -25,46 +58,345 @@ print(response)
 
 # Define the LLMIntegration class
 class LLMIntegration:
-    def __init__(self, api_url="http://localhost:11434/api/generate"):          # Initialize the LLMIntegration class with the API URL
-        self.api_url = api_url                                                  # Set the API URL
+    def __init__(self, api_url="http://localhost:11434/api/generate", client=None, async_client=None, response_cache=None,
+                 router=None, simple_model="llama3.2:1B", reasoned_model="deepseek-r1:1.5b", scheduler=None):  # Initialize the LLMIntegration class with the API URL
+        self.api_url = api_url                                                  # Set the API URL, used when there is no router
+        self.router = router                                                    # Optional LLMRouter spreading requests over several hosts
+        self.simple_model = simple_model
+        self.reasoned_model = reasoned_model
+        self.response_cache = response_cache                                    # Optional ResponseCache for finished responses
+        self.scheduler = scheduler                                              # Optional LLMScheduler queueing requests per model
+        self.client = client or LLMClient(**self.client_options())              # Keep-alive pool shared by every sync call
+        self.savings = ComputeSavings()                                         # Model time not spent on requests whose client left
+        self._async_client = async_client                                       # Created on first use so it binds to the running loop
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = AsyncLLMClient(**self.client_options())
+        return self._async_client
+
+    def client_options(self):
+        options = {}
+        if self.scheduler is not None:
+            options["pool_size"] = self.scheduler.capacity((self.simple_model, self.reasoned_model))
+        if self.router is not None and len(self.router.backends) > 1:
+            options["max_retries"] = 0
+        return options
+
+    # Backends to try in order; [None] stands for api_url when there is no router
+    def backends(self, model):
+        if self.router is None:
+            return [None]
+        return self.router.candidates(model)
+
+    def url_for(self, backend):
+        return self.api_url if backend is None else backend.generate_url
+
+    def track(self, backend):
+        return nullcontext() if backend is None else self.router.track(backend)
+
+    def failed(self, backend, error):
+        metrics.LLM_BACKEND_FAILURES.inc(backend=self.url_for(backend))
+        if backend is not None:
+            self.router.mark_failed(backend, error)
+
+    # Wait for the scheduler to let a request for the model through; schedule is (conversation_id, priority)
+    def slot(self, model, schedule=None):
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(model, *(schedule or (None, PRIORITY_SIMPLE)))
+
+    def aslot(self, model, schedule=None):
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.aslot(model, *(schedule or (None, PRIORITY_SIMPLE)))
+
+    # Record a finished generation: its duration for the compute savings estimate, and Ollama's timings for /metrics
+    def finished(self, model, result, started, mode="generate"):
+        elapsed = time.monotonic() - started
+        self.savings.completed(model, result["total_duration"] / 1e9 if result.get("total_duration") else elapsed)
+        metrics.LLM_REQUEST_SECONDS.observe(elapsed, model=model, mode=mode)
+        for histogram, field in ((metrics.LLM_PROMPT_EVAL_SECONDS, "prompt_eval_duration"),
+                                 (metrics.LLM_EVAL_SECONDS, "eval_duration"), (metrics.LLM_LOAD_SECONDS, "load_duration")):
+            if result.get(field) is not None:
+                histogram.observe(result[field] / 1e9, model=model)
+        if result.get("prompt_eval_count") is not None:
+            metrics.LLM_PROMPT_SIZE.observe(result["prompt_eval_count"], model=model)
+            metrics.LLM_PROMPT_TOKENS.inc(result["prompt_eval_count"], model=model)
+        if result.get("eval_count") is not None:
+            metrics.LLM_COMPLETION_TOKENS.inc(result["eval_count"], model=model)
 
     # Generate a simple response using the llama3.2 model
-    def generate_simple_response(self, prompt):
-        # Set the request headers and data
-        headers = {
-            "Content-Type": "application/json"                                  # Set the content type to JSON
-        }
+    def generate_simple_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return self.generate_response(self.simple_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    # Generate a reasoned response using the deepseek-r1 model
+    def generate_reasoned_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return self.generate_response(self.reasoned_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    def generate_response(self, model, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
         data = {
-            "model": "llama3.2:1B",                                             # Set the model to llama3.2:1B
+            "model": model,                                                     # Set the model to generate with
             "prompt": prompt,                                                   # Set the prompt to the user input
             "stream": False                                                     # Set the stream flag to False
         }
-        # Send a POST request to the LLM API
+        if context:
+            data["context"] = context                                           # Continue from the tokens Ollama returned last turn
+        if cancel is None:
+            fetch = lambda: self.fetch_response(data, schedule)
+        else:
+            fetch = lambda: self.collect_response(data, schedule, cancel)       # Streamed upstream so it can stop early
+        if use_cache and self.response_cache is not None:
+            result = self.response_cache.get_or_fetch(data, fetch)              # Identical requests share one generation
+        else:
+            result = fetch()
+        if on_done and not result.get("error"):
+            on_done(result)                                                     # Hand back the context and timings
+        return result.get("response", "")                                       # Return the response from the API
+
+    def fetch_response(self, data, schedule=None):
         try:
-            response = requests.post(self.api_url, json=data)                   # Send a POST request to the LLM API
-            if response.status_code == 200:                                     # Check if the response status code is 200 (OK)
-                return response.json().get("response", "")                      # Return the response from the API
-            else:                                                               # If the response status code is not 200
-                return "Error: Unable to generate response"                     # Return an error message
-        except requests.exceptions.RequestException as e:                       # Handle request exceptions
-            return f"Error: {e}"                                                # Return an error message with the exception
-        
-    def generate_reasoned_response(self, prompt):                               # Generate a reasoned response using the deepseek-r1 model
-        # Set the request headers and data
-        headers = {
-            "Content-Type": "application/json"                                  # Set the content type to JSON
-        }
+            with self.slot(data["model"], schedule):                            # Queue behind other requests for the model
+                started = time.monotonic()
+                result = {"response": f"Error: No backend serves {data['model']}", "error": "no backend"}
+                for backend in self.backends(data["model"]):                    # Fail over to the next backend on errors
+                    # Send a POST request to the LLM API
+                    try:
+                        with self.track(backend):
+                            response = self.client.post(self.url_for(backend), data)    # Send a POST request to the LLM API
+                        if response.status_code == 200:                         # Check if the response status code is 200 (OK)
+                            result = response.json()
+                            self.finished(data["model"], result, started)
+                            return result                                       # Return the response from the API
+                        result = {"response": "Error: Unable to generate response", "error": response.status_code}  # Return an error message
+                        if response.status_code >= 500:
+                            self.failed(backend, f"HTTP {response.status_code}")
+                    except requests.exceptions.RequestException as e:           # Handle request exceptions
+                        result = {"response": f"Error: {e}", "error": str(e)}   # Return an error message with the exception
+                        self.failed(backend, e)
+                return result
+        except SchedulerBusy as e:
+            return {"response": f"Error: {e}", "error": "busy", "retry_after": e.retry_after}
+
+    # Generate through the streaming API, stopping as soon as cancel is set
+    def collect_response(self, data, schedule=None, cancel=None):
+        done = {}
+        tokens = list(self.stream_response(data["model"], data["prompt"], data.get("context"), done.update, False, schedule, cancel))
+        if done:
+            return done
+        if cancel is not None and cancel.is_set():
+            return {"response": "Error: Request cancelled", "error": "cancelled"}
+        return {"response": "".join(tokens) or "Error: Unable to generate response", "error": "stream failed"}
+
+    # Stream a simple response token by token using the llama3.2 model
+    def stream_simple_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return self.stream_response(self.simple_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    # Stream a reasoned response token by token using the deepseek-r1 model
+    def stream_reasoned_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return self.stream_response(self.reasoned_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    # Yield tokens from Ollama's NDJSON stream as they arrive
+    def stream_response(self, model, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
         data = {
-            "model": "deepseek-r1:1.5b",                                        # Set the model to deepseek-r1:1.5b
+            "model": model,                                                     # Set the model to generate with
             "prompt": prompt,                                                   # Set the prompt to the user input
-            "stream": False                                                     # Set the stream flag to False
+            "stream": True                                                      # Ask Ollama for one JSON object per token
         }
-        # Send a POST request to the LLM API
+        if context:
+            data["context"] = context                                           # Continue from the tokens Ollama returned last turn
+        cache = self.response_cache if use_cache else None
+        cache_request = dict(data, stream=False)                                # Streamed and plain requests share cache entries
+        if cache is not None:
+            cached = cache.get(cache_request)
+            if cached is not None:
+                if cached.get("response"):
+                    yield cached["response"]
+                if on_done:
+                    on_done(cached)
+                return
+        tokens = []
+        started = None
+        if cancel is not None and cancel.is_set():                              # The client left before this stage started
+            self.savings.skipped(model)
+            return
+        try:
+            with self.slot(model, schedule):
+                if cancel is not None and cancel.is_set():                      # or while it was queued
+                    self.savings.skipped(model)
+                    return
+                started = time.monotonic()
+                error = "Error: Unable to generate response"
+                for backend in self.backends(model):
+                    try:
+                        # Closing the generator early closes the response, which tells Ollama to stop generating
+                        with self.track(backend), self.client.stream(self.url_for(backend), data) as response:
+                            if response.status_code != 200:                     # Check if the response status code is 200 (OK)
+                                if response.status_code >= 500:
+                                    self.failed(backend, f"HTTP {response.status_code}")
+                                continue                                        # Nothing was sent yet, so try the next backend
+                            for line in response.iter_lines():                  # Each non-empty line is one JSON chunk
+                                if not line:
+                                    continue
+                                chunk = json.loads(line)
+                                if chunk.get("error"):                          # Ollama reports mid-stream failures in an error field
+                                    yield f"Error: {chunk['error']}"
+                                    return
+                                token = chunk.get("response", "")
+                                if token:
+                                    if not tokens:
+                                        metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - started, model=model)
+                                    tokens.append(token)
+                                    yield token
+                                if chunk.get("done"):                           # The final chunk carries the context and timings, not text
+                                    result = dict(chunk, response="".join(tokens))
+                                    self.finished(model, result, started, "stream")
+                                    if cache is not None:
+                                        cache.put(cache_request, result)
+                                    if on_done:
+                                        on_done(result)
+                                    return
+                                if cancel is not None and cancel.is_set():      # Leaving the with block closes the upstream response
+                                    self.savings.aborted(model, time.monotonic() - started)
+                                    return
+                            return
+                    except requests.exceptions.RequestException as e:           # Handle request exceptions
+                        self.failed(backend, e)
+                        error = f"Error: {e}"
+                        if tokens:                                              # Part of the answer is out, so it cannot move to another backend
+                            break
+                yield error
+        except SchedulerBusy as e:
+            yield f"Error: {e}"
+        except GeneratorExit:                                                   # The consumer stopped reading, e.g. the client disconnected
+            if started is not None:
+                self.savings.aborted(model, time.monotonic() - started)
+            raise
+
+    # Asyncio versions of the methods above, for callers running on an event loop
+    async def agenerate_simple_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return await self.agenerate_response(self.simple_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    async def agenerate_reasoned_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return await self.agenerate_response(self.reasoned_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    def astream_simple_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return self.astream_response(self.simple_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    def astream_reasoned_response(self, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        return self.astream_response(self.reasoned_model, prompt, context, on_done, use_cache, schedule, cancel)
+
+    # Tasks are stopped by cancelling them; cancel is only checked before the request starts
+    async def agenerate_response(self, model, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        if cancel is not None and cancel.is_set():
+            self.savings.skipped(model)
+            return "Error: Request cancelled"
+        data = {"model": model, "prompt": prompt, "stream": False}
+        if context:
+            data["context"] = context
+        if use_cache and self.response_cache is not None:
+            result = await self.response_cache.aget_or_fetch(data, lambda: self.afetch_response(data, schedule))
+        else:
+            result = await self.afetch_response(data, schedule)
+        if on_done and not result.get("error"):
+            on_done(result)
+        return result.get("response", "")
+
+    async def afetch_response(self, data, schedule=None):
+        try:
+            async with self.aslot(data["model"], schedule):
+                started = time.monotonic()
+                result = {"response": f"Error: No backend serves {data['model']}", "error": "no backend"}
+                for backend in self.backends(data["model"]):
+                    try:
+                        with self.track(backend):
+                            response = await self.async_client.post(self.url_for(backend), data)
+                        if response.status_code == 200:
+                            result = response.json()
+                            self.finished(data["model"], result, started)
+                            return result
+                        result = {"response": "Error: Unable to generate response", "error": response.status_code}
+                        if response.status_code >= 500:
+                            self.failed(backend, f"HTTP {response.status_code}")
+                    except httpx.HTTPError as e:
+                        result = {"response": f"Error: {e}", "error": str(e)}
+                        self.failed(backend, e)
+                    except asyncio.CancelledError:                              # Cancelling the task closes the upstream request
+                        self.savings.aborted(data["model"], time.monotonic() - started)
+                        raise
+                return result
+        except SchedulerBusy as e:
+            return {"response": f"Error: {e}", "error": "busy", "retry_after": e.retry_after}
+
+    async def astream_response(self, model, prompt, context=None, on_done=None, use_cache=True, schedule=None, cancel=None):
+        data = {"model": model, "prompt": prompt, "stream": True}
+        if context:
+            data["context"] = context
+        cache = self.response_cache if use_cache else None
+        cache_request = dict(data, stream=False)
+        if cache is not None:
+            cached = cache.get(cache_request)
+            if cached is not None:
+                if cached.get("response"):
+                    yield cached["response"]
+                if on_done:
+                    on_done(cached)
+                return
+        tokens = []
+        started = None
+        if cancel is not None and cancel.is_set():
+            self.savings.skipped(model)
+            return
         try:
-            response = requests.post(self.api_url, json=data)                   # Send a POST request to the LLM API
-            if response.status_code == 200:                                     # Check if the response status code is 200 (OK)
-                return response.json().get("response", "")                      # Return the response from the API
-            else:                                                               # If the response status code is not 200
-                return "Error: Unable to generate response"                     # Return an error message
-        except requests.exceptions.RequestException as e:                       # Handle request exceptions
-            return f"Error: {e}"                                                # Return an error message with the exception
\ No newline at end of file
+            async with self.aslot(model, schedule):
+                if cancel is not None and cancel.is_set():
+                    self.savings.skipped(model)
+                    return
+                started = time.monotonic()
+                error = "Error: Unable to generate response"
+                for backend in self.backends(model):
+                    try:
+                        with self.track(backend):
+                            async with self.async_client.stream(self.url_for(backend), data) as response:
+                                if response.status_code != 200:
+                                    if response.status_code >= 500:
+                                        self.failed(backend, f"HTTP {response.status_code}")
+                                    continue
+                                async for line in response.aiter_lines():
+                                    if not line:
+                                        continue
+                                    chunk = json.loads(line)
+                                    if chunk.get("error"):
+                                        yield f"Error: {chunk['error']}"
+                                        return
+                                    token = chunk.get("response", "")
+                                    if token:
+                                        if not tokens:
+                                            metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.monotonic() - started, model=model)
+                                        tokens.append(token)
+                                        yield token
+                                    if chunk.get("done"):
+                                        result = dict(chunk, response="".join(tokens))
+                                        self.finished(model, result, started, "stream")
+                                        if cache is not None:
+                                            cache.put(cache_request, result)
+                                        if on_done:
+                                            on_done(result)
+                                        return
+                                    if cancel is not None and cancel.is_set():
+                                        self.savings.aborted(model, time.monotonic() - started)
+                                        return
+                                return
+                    except httpx.HTTPError as e:
+                        self.failed(backend, e)
+                        error = f"Error: {e}"
+                        if tokens:
+                            break
+                yield error
+        except SchedulerBusy as e:
+            yield f"Error: {e}"
+        except (asyncio.CancelledError, GeneratorExit):
+            if started is not None:
+                self.savings.aborted(model, time.monotonic() - started)
+            raise
@@ -0,0 +1,128 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+'''
+This module spreads LLM requests over several Ollama hosts.
+
+LLMRouter holds a pool of Backends, each with the models it serves. A background thread polls every backend's
+/api/tags every health_interval seconds; a backend that answers is healthy, and when it was configured without
+a model list the models it reports are used. candidates(model) orders the healthy backends that serve the model
+by their outstanding requests, fewest first, and LLMIntegration tries them in that order, so a request that
+fails on one backend is retried on the next. A backend that fails a request is marked unhealthy until its next
+successful health check. If none is healthy, every backend serving the model is tried anyway.
+
+Backends are configured as a string of entries separated by spaces or semicolons. Each entry is a base URL,
+optionally followed by "=" and a comma-separated list of models.
+
+Example usage:
+router = LLMRouter(parse_backends("http://gpu1:11434=llama3.2:1B,deepseek-r1:1.5b; http://gpu2:11434")).start()
+llm_integration = LLMIntegration(router=router)
+print(router.status())
+'''
+
+class Backend:
+    def __init__(self, url, models=None):
+        self.url = url.rstrip('/')
+        self.generate_url = f"{self.url}/api/generate"
+        self.configured_models = {model.lower() for model in models or ()}
+        self.models = set(self.configured_models)                               # Filled from /api/tags when none were configured
+        self.healthy = True                                                     # Optimistic until the first check says otherwise
+        self.outstanding = 0
+        self.failures = 0
+        self.last_error = None
+        self.checked = None
+
+    def serves(self, model):
+        return not self.models or model.lower() in self.models
+
+    def status(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "models": sorted(self.models),
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "last_error": self.last_error
+        }
+
+def parse_backends(spec):
+    backends = []
+    for entry in spec.replace(';', ' ').split():
+        url, _, models = entry.partition('=')
+        backends.append(Backend(url, [model for model in models.split(',') if model]))
+    return backends
+
+class LLMRouter:
+    def __init__(self, backends, health_interval=10, health_timeout=2):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = list(backends)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._health_loop, name="llm-router-health", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        atexit.register(self.close)
+        return self
+
+    def _health_loop(self):
+        while not self.stopped.is_set():
+            self.check_health()
+            self.stopped.wait(self.health_interval)
+
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                response = self.session.get(f"{backend.url}/api/tags", timeout=self.health_timeout)
+                response.raise_for_status()
+                models = {model["name"].lower() for model in response.json().get("models", [])}
+                with self.lock:
+                    backend.healthy = True
+                    backend.last_error = None
+                    if not backend.configured_models:
+                        backend.models = models
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self.lock:
+                    backend.healthy = False
+                    backend.last_error = str(e)
+            backend.checked = time.time()
+
+    # Backends to try for a model, healthy and least loaded first
+    def candidates(self, model):
+        with self.lock:
+            serving = [backend for backend in self.backends if backend.serves(model)]
+            healthy = [backend for backend in serving if backend.healthy]
+            return sorted(healthy or serving, key=lambda backend: backend.outstanding)
+
+    @contextmanager
+    def track(self, backend):
+        with self.lock:
+            backend.outstanding += 1
+        try:
+            yield backend
+        finally:
+            with self.lock:
+                backend.outstanding -= 1
+
+    def mark_failed(self, backend, error):
+        with self.lock:
+            backend.healthy = False
+            backend.failures += 1
+            backend.last_error = str(error)
+
+    def status(self):
+        with self.lock:
+            backends = [backend.status() for backend in self.backends]
+        return {"state": "loaded" if any(backend["healthy"] for backend in backends) else "failed", "backends": backends}
+
+    def close(self):
+        self.stopped.set()
+        self.session.close()
@@ -0,0 +1,133 @@
+import base64
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+'''
+This module keeps a secondary index of stored memories ordered by conversation and time.
+
+Every call to /store_memory is one turn. The vectors of a turn live in Chroma for similarity search, and the turn
+itself is recorded here, once, in an SQLite table keyed by turn id and indexed on (conversation_id, timestamp).
+Vectors only carry the turn id and a few scalars, so this table is the one copy of the messages: memory recall
+looks up the turns it ranked with get(), and latest-N and paginated history are a single index range scan instead
+of an ANN query that has to embed an empty string.
+
+Pages are returned newest first. The cursor is an opaque string that encodes the (timestamp, turn_id) of the last
+row returned, so pagination stays stable while new turns are being written. The oldest, expired and oversized
+queries serve the background compaction in compaction.py.
+
+Example usage:
+index = MemoryIndex("chroma/memory_index.db")
+index.add("turn-1", 7, "2025-01-01T10:00:00", metadata_json)
+memories = index.latest(7, 5)
+turns = index.get(["turn-1"])
+page, cursor = index.page(7, 50)
+'''
+
+def to_epoch(timestamp):
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return 0.0
+    # Timestamps written by the server are naive UTC
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def encode_cursor(timestamp, turn_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, turn_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, turn_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(timestamp), str(turn_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+class MemoryIndex:
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS turns (
+                turn_id TEXT PRIMARY KEY,
+                conversation_id TEXT,
+                timestamp REAL,
+                metadata TEXT)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS turns_by_conversation ON turns (conversation_id, timestamp, turn_id)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS turns_by_time ON turns (timestamp)")
+            self.db.commit()
+
+    def count(self, conversation_id=None):
+        with self.lock:
+            if conversation_id is None:
+                return self.db.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+            return self.db.execute("SELECT COUNT(*) FROM turns WHERE conversation_id = ?", (str(conversation_id),)).fetchone()[0]
+
+    def add(self, turn_id, conversation_id, timestamp, metadata_json):
+        self.add_many([(turn_id, conversation_id, timestamp, metadata_json)])
+
+    # rows are (turn_id, conversation_id, ISO timestamp, metadata JSON)
+    def add_many(self, rows):
+        rows = [(turn_id, str(conversation_id), to_epoch(timestamp), metadata_json) for turn_id, conversation_id, timestamp, metadata_json in rows]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO turns (turn_id, conversation_id, timestamp, metadata) VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    # {turn_id: memory} for the turns that exist
+    def get(self, turn_ids):
+        turn_ids = list(turn_ids)
+        if not turn_ids:
+            return {}
+        with self.lock:
+            rows = self.db.execute(f"SELECT turn_id, metadata FROM turns WHERE turn_id IN ({','.join('?' * len(turn_ids))})", turn_ids).fetchall()
+        return {turn_id: json.loads(metadata_json) for turn_id, metadata_json in rows}
+
+    # (turn_id, metadata JSON) of every turn
+    def rows(self):
+        with self.lock:
+            return self.db.execute("SELECT turn_id, metadata FROM turns").fetchall()
+
+    def remove(self, turn_ids):
+        with self.lock:
+            self.db.executemany("DELETE FROM turns WHERE turn_id = ?", [(turn_id,) for turn_id in turn_ids])
+            self.db.commit()
+
+    # (conversation_id, turn count) of every conversation with more than limit turns
+    def conversations_over(self, limit):
+        with self.lock:
+            return self.db.execute("SELECT conversation_id, COUNT(*) FROM turns GROUP BY conversation_id HAVING COUNT(*) > ?", (limit,)).fetchall()
+
+    # (turn_id, metadata JSON) of a conversation's oldest turns, oldest first
+    def oldest(self, conversation_id, limit):
+        with self.lock:
+            return self.db.execute("SELECT turn_id, metadata FROM turns WHERE conversation_id = ? ORDER BY timestamp, turn_id LIMIT ?",
+                                   (str(conversation_id), limit)).fetchall()
+
+    # (turn_id, metadata JSON) of turns stored before the epoch time cutoff
+    def expired(self, cutoff, limit=1000):
+        with self.lock:
+            return self.db.execute("SELECT turn_id, metadata FROM turns WHERE timestamp < ? ORDER BY timestamp LIMIT ?", (cutoff, limit)).fetchall()
+
+    def latest(self, conversation_id, limit=5):
+        memories, _ = self.page(conversation_id, limit)
+        return memories
+
+    def page(self, conversation_id, limit=100, cursor=None):
+        query = "SELECT turn_id, timestamp, metadata FROM turns WHERE conversation_id = ?"
+        params = [str(conversation_id)]
+        if cursor:
+            timestamp, turn_id = decode_cursor(cursor)
+            query += " AND (timestamp < ? OR (timestamp = ? AND turn_id < ?))"
+            params += [timestamp, timestamp, turn_id]
+        query += " ORDER BY timestamp DESC, turn_id DESC LIMIT ?"
+        params.append(limit + 1)                                                # One extra row tells us whether there is a next page
+
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return [json.loads(row[2]) for row in rows], next_cursor
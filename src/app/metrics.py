@@ -0,0 +1,186 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+'''
+This module collects latency histograms and counters for the request pipeline and renders them in the Prometheus
+text format for /metrics.
+
+Metrics are plain objects registered on REGISTRY and defined at the bottom of this module, so any module can
+import the ones it records. Labels are passed as keyword arguments. Recording a value takes one lock and a
+bisect over fixed buckets, which is cheap enough to leave on in production. Values that already live somewhere
+else, like scheduler queue depths or cache sizes, are read only when /metrics is scraped: register a gauge with a
+function that returns {label values: value}.
+
+Every LLM generation records its latency, time to first token and Ollama's own timings (prompt_eval_duration,
+eval_duration, load_duration), along with its prompt and completion token counts. STAGE_SECONDS times the other
+steps of a request (embedding, Chroma upserts and queries, memory recall, retrieval, extraction, crawling).
+
+Example usage:
+with STAGE_SECONDS.time(stage="chroma_query"):
+    collection.query(query_embeddings=[vector], n_results=5)
+LLM_PROMPT_TOKENS.inc(result["prompt_eval_count"], model="llama3.2:1B")
+print(REGISTRY.render())
+'''
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}                                                        # label values -> value
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self):
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self):
+        lines = self.header()
+        for key, value in self.samples():
+            lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        self.function = function                                                # Called at scrape time instead of storing values
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(key if isinstance(key, tuple) else (key,), value) for key, value in values.items()]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]  # bucket counts, sum, count
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            entries = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, labels=()):
+        return self.register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=(), function=None):
+        return self.register(Gauge(name, description, labels, function))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:                                              # A failing gauge function must not break the scrape
+                print(f"Failed to render metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("chatbot_http_request_seconds", "Time to answer an HTTP request, up to the first byte for streams", ("route", "method", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("chatbot_http_in_flight", "HTTP requests being served")
+STAGE_SECONDS = REGISTRY.histogram("chatbot_stage_seconds", "Time spent in one step of a request", ("stage",))
+LLM_REQUEST_SECONDS = REGISTRY.histogram("chatbot_llm_request_seconds", "Time from sending a generation to Ollama to its last token", ("model", "mode"))
+LLM_QUEUE_SECONDS = REGISTRY.histogram("chatbot_llm_queue_seconds", "Time a generation waited for a scheduler slot", ("model",))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram("chatbot_llm_first_token_seconds", "Time from sending a streamed generation to its first token", ("model",))
+LLM_PROMPT_EVAL_SECONDS = REGISTRY.histogram("chatbot_llm_prompt_eval_seconds", "Ollama prompt_eval_duration", ("model",))
+LLM_EVAL_SECONDS = REGISTRY.histogram("chatbot_llm_eval_seconds", "Ollama eval_duration", ("model",))
+LLM_LOAD_SECONDS = REGISTRY.histogram("chatbot_llm_load_seconds", "Ollama load_duration", ("model",))
+LLM_PROMPT_SIZE = REGISTRY.histogram("chatbot_llm_prompt_size_tokens", "Prompt tokens Ollama evaluated per generation", ("model",), TOKEN_BUCKETS)
+LLM_PROMPT_TOKENS = REGISTRY.counter("chatbot_llm_prompt_tokens_total", "Prompt tokens evaluated by Ollama", ("model",))
+LLM_COMPLETION_TOKENS = REGISTRY.counter("chatbot_llm_completion_tokens_total", "Tokens generated by Ollama", ("model",))
+LLM_BACKEND_FAILURES = REGISTRY.counter("chatbot_llm_backend_failures_total", "Generations that failed on a backend", ("backend",))
+EMBEDDING_BATCH_SIZE = REGISTRY.histogram("chatbot_embedding_batch_size", "Texts encoded per sentence model call", (), SIZE_BUCKETS)
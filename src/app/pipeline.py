@@ -0,0 +1,171 @@
+import asyncio
+import re
+import time
+
+'''
+This module runs the chain of model calls behind reasoning chats.
+
+A Pipeline is a list of Stages, each naming the model that runs it, "simple" or "reasoned". The first stage gets
+the user's input and every later stage gets the output of the one before, wrapped in the prompt for its model.
+The first stage on the simple model continues the conversation's Ollama context. parse_pipeline reads stages from
+a string like "draft=simple,reasoning=reasoned,final=simple", which is the original three-call chain; the default
+sends the question straight to the reasoner and has the simple model summarize its answer, without a draft.
+
+Before running, plan() asks needs_reasoning whether the question is worth the reasoner at all. The default is a
+cheap heuristic on the wording (why, how, explain, compare, arithmetic, long or multi-part questions); any
+function that takes the input and returns a bool can replace it, e.g. a small classifier. Questions that do not
+need reasoning are answered by the simple model in one call. mode "always" skips the check, "never" always
+answers in one call. Pass question when user_input carries more than the user's message, such as recalled
+memories, so only the message itself is checked.
+
+The reasoner's <think> section is dropped before its answer is handed on, so the summarizer's prompt only holds
+the answer. stream() yields each stage's tokens as they arrive and starts the next stage on the final chunk of
+the previous one. Both run() and stream() report per-stage timings: seconds, plus seconds to the first token
+when streaming. If the client goes away mid-chain, the stages that never ran are counted as skipped.
+
+Example usage:
+pipeline = Pipeline(parse_pipeline("reasoning=reasoned,final=simple"))
+response, timings = pipeline.run(chatbot, "Why is the sky blue?")
+for event in pipeline.stream(chatbot, "Why is the sky blue?"):
+    print(event)                                # {"stage", "token"}, then {"stage", "done", "response", "timings"}
+'''
+
+REASONING_CUES = re.compile(r"\b(why|how|explain|compare|contrast|prove|derive|calculate|compute|solve|analy[sz]e|"
+                            r"evaluate|estimate|step by step|trade-?offs?|pros and cons|difference between|what if|should i)\b", re.I)
+ARITHMETIC = re.compile(r"\d\s*[-+*/^%=<>]\s*\d")
+THINKING = re.compile(r"<think>.*?</think>", re.S)
+
+PROMPTS = {
+    "reasoned": "Our client is requesting about this: {input}",
+    "simple": "Here is the relevant reasoned response: {input}"
+}
+
+def needs_reasoning(text, max_simple_words=40):
+    words = len(text.split())
+    if words <= 3:                                                              # Greetings and one-word questions
+        return False
+    return bool(REASONING_CUES.search(text) or ARITHMETIC.search(text)) or words > max_simple_words or text.count('?') > 1
+
+def strip_thinking(text):
+    return THINKING.sub("", text).strip()
+
+class Stage:
+    def __init__(self, name, model="simple"):
+        if model not in PROMPTS:
+            raise ValueError(f"Unknown model for stage {name}: {model}")
+        self.name = name
+        self.model = model
+
+def parse_pipeline(spec):
+    stages = []
+    for entry in spec.split(','):
+        name, _, model = entry.strip().partition('=')
+        if name:
+            stages.append(Stage(name, model or "simple"))
+    return stages
+
+class Pipeline:
+    def __init__(self, stages, mode="auto", needs_reasoning=needs_reasoning):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.mode = mode                                                        # "auto", "always" or "never"
+        self.needs_reasoning = needs_reasoning
+        self.direct = [Stage(self.stages[-1].name, "simple")]                   # One call, under the name of the last stage
+
+    def plan(self, user_input):
+        if self.mode == "never" or (self.mode == "auto" and not self.needs_reasoning(user_input)):
+            return self.direct
+        return self.stages
+
+    def prompt(self, index, stage, previous):
+        if index == 0:
+            return previous
+        return PROMPTS[stage.model].format(input=strip_thinking(previous))
+
+    def call(self, chatbot, kind, stages, index, prompt, session, chunks, use_cache, schedule, cancel):
+        stage = stages[index]
+        if stage.model == "reasoned":
+            return getattr(chatbot, f"{kind}_reasoned_response")(prompt, use_cache, schedule, cancel)
+        if index != next(i for i, s in enumerate(stages) if s.model == "simple"):
+            session, chunks = None, ()                                          # Only one stage continues the conversation
+        elif index > 0:
+            chunks = ()                                                         # Its prompt is the previous answer, not the excerpts
+        return getattr(chatbot, f"{kind}_simple_response")(prompt, session, chunks, use_cache, schedule, cancel)
+
+    def timing(self, stage, started, first_token=None):
+        timing = {"stage": stage.name, "model": stage.model, "seconds": round(time.monotonic() - started, 3)}
+        if first_token is not None:
+            timing["first_token"] = round(first_token, 3)
+        return timing
+
+    def skip(self, chatbot, stages):
+        chatbot.skip_stages([stage.model for stage in stages])
+
+    def run(self, chatbot, user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None, question=None):
+        stages = self.plan(question or user_input)
+        output, timings = user_input, []
+        for index, stage in enumerate(stages):
+            if cancel is not None and cancel.is_set():
+                self.skip(chatbot, stages[index:])
+                break
+            started = time.monotonic()
+            output = self.call(chatbot, "get", stages, index, self.prompt(index, stage, output), session, chunks, use_cache, schedule, cancel)
+            timings.append(self.timing(stage, started))
+        return output, timings
+
+    def stream(self, chatbot, user_input, session=None, chunks=(), use_cache=True, schedule=None, cancel=None, question=None):
+        stages = self.plan(question or user_input)
+        output, timings = user_input, []
+        index = 0
+        try:
+            for index, stage in enumerate(stages):
+                if cancel is not None and cancel.is_set():                      # The stage before stopped early for a client that left
+                    self.skip(chatbot, stages[index:])
+                    return
+                started, first_token, parts = time.monotonic(), None, []
+                for token in self.call(chatbot, "stream", stages, index, self.prompt(index, stage, output), session, chunks, use_cache, schedule, cancel):
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    parts.append(token)
+                    yield {"stage": stage.name, "token": token}
+                timings.append(self.timing(stage, started, first_token))
+                output = "".join(parts)
+            yield {"stage": stages[-1].name, "done": True, "response": output, "timings": timings}
+        except GeneratorExit:                                                   # The client disconnected; the later stages never start
+            self.skip(chatbot, stages[index + 1:])
+            raise
+
+    # Asyncio versions for the ASGI entry point
+    async def arun(self, chatbot, user_input, session=None, chunks=(), use_cache=True, schedule=None, question=None):
+        stages = self.plan(question or user_input)
+        output, timings = user_input, []
+        index = 0
+        try:
+            for index, stage in enumerate(stages):
+                started = time.monotonic()
+                output = await self.call(chatbot, "aget", stages, index, self.prompt(index, stage, output), session, chunks, use_cache, schedule, None)
+                timings.append(self.timing(stage, started))
+        except asyncio.CancelledError:
+            self.skip(chatbot, stages[index + 1:])
+            raise
+        return output, timings
+
+    async def astream(self, chatbot, user_input, session=None, chunks=(), use_cache=True, schedule=None, question=None):
+        stages = self.plan(question or user_input)
+        output, timings = user_input, []
+        index = 0
+        try:
+            for index, stage in enumerate(stages):
+                started, first_token, parts = time.monotonic(), None, []
+                async for token in self.call(chatbot, "astream", stages, index, self.prompt(index, stage, output), session, chunks, use_cache, schedule, None):
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                    parts.append(token)
+                    yield {"stage": stage.name, "token": token}
+                timings.append(self.timing(stage, started, first_token))
+                output = "".join(parts)
+            yield {"stage": stages[-1].name, "done": True, "response": output, "timings": timings}
+        except (asyncio.CancelledError, GeneratorExit):
+            self.skip(chatbot, stages[index + 1:])
+            raise
@@ -0,0 +1,127 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from src.app.metrics import STAGE_SECONDS
+
+'''
+This module finds the stored memories that are relevant to a chat message so they can be added to its prompt.
+
+MemoryRecall embeds the message and asks Chroma for the nearest stored texts of the same conversation. Every
+vector carries its turn id and timestamp, so hits are grouped by turn and a turn keeps its best similarity. Turns
+are then re-ranked on a mix of similarity and recency: similarity comes from the vector distance, recency halves
+every half_life seconds, and recency_weight is the share of recency in the score. Only the top_k turns at or
+above min_similarity are read from the MemoryIndex, and they are returned best first.
+
+The lookup has a hard budget of budget_ms milliseconds. It runs on a small worker pool, and when it has not
+finished in time the chat goes ahead without memories. The lookup still completes in the background and warms
+the embedding cache. Recall is also skipped while the embedding model or Chroma is still loading, and when
+enough lookups are already pending that a new one could not finish in time.
+
+Example usage:
+recall = MemoryRecall(embedding_service.encode, memory_collection.get, memory_index.get,
+                      (sentence_model, memory_collection, memory_index), budget_ms=150)
+memories = recall.recall("What did I say about the trip?", conversation_id)
+prompt = f"{message}\n\n{format_memories(memories)}"
+'''
+
+def format_memories(memories, max_chars=500):
+    lines = ["Relevant memories from this conversation:"]
+    for memory in memories:
+        for role, key in (("User", "userMessage"), ("Assistant", "botMessage")):
+            message = memory.get(key)
+            if isinstance(message, dict) and message.get("text"):
+                lines.append(f"- {role}: {message['text'][:max_chars]}")
+    return "\n".join(lines)
+
+class MemoryRecall:
+    def __init__(self, encode, collection, index, ready=(), top_k=3, candidates=12, budget_ms=150, half_life=7 * 86400,
+                 recency_weight=0.3, min_similarity=0.2, workers=2):
+        self.encode = encode
+        self.collection = collection                                            # Returns the Chroma collection
+        self.index = index                                                      # Returns the MemoryIndex holding the turns
+        self.ready = ready                                                      # LazyResources that must be loaded before recalling
+        self.top_k = top_k
+        self.candidates = candidates                                            # Nearest texts fetched before grouping and re-ranking
+        self.budget_ms = budget_ms
+        self.half_life = half_life
+        self.recency_weight = recency_weight
+        self.min_similarity = min_similarity
+        self.max_pending = workers * 2
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="memory-recall")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.recalled = 0
+        self.over_budget = 0
+        self.not_ready = 0
+        self.failed = 0
+        self.lookup_ms = 0.0                                                    # Moving average of finished lookups
+
+    def recall(self, text, conversation_id):
+        if conversation_id is None or self.budget_ms <= 0:
+            return []
+        if not all(resource.loaded for resource in self.ready):
+            self.not_ready += 1
+            return []
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.over_budget += 1
+                return []
+            self.pending += 1
+        future = self.pool.submit(self.lookup, text, conversation_id)
+        try:
+            memories = future.result(timeout=self.budget_ms / 1000)
+        except TimeoutError:
+            self.over_budget += 1
+            return []
+        except Exception as e:
+            self.failed += 1
+            print(f"Memory recall failed: {e}")
+            return []
+        self.recalled += 1
+        return memories
+
+    def lookup(self, text, conversation_id):
+        started = time.perf_counter()
+        try:
+            vector = self.encode([text])[0].tolist()
+            with STAGE_SECONDS.time(stage="chroma_query"):
+                result = self.collection().query(query_embeddings=[vector], n_results=self.candidates,
+                                                 where={"conversation_id": conversation_id},
+                                                 include=["metadatas", "distances"])
+            ranked = self.rank(result["metadatas"][0], result["distances"][0])
+            turns = self.index().get(ranked)
+            return [turns[turn_id] for turn_id in ranked if turn_id in turns]
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.lookup_ms = 0.8 * self.lookup_ms + 0.2 * (time.perf_counter() - started) * 1000
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="memory_recall")
+
+    # Turn ids of the best turns, best first
+    def rank(self, metadatas, distances):
+        turns = {}
+        for metadata, distance in zip(metadatas, distances):
+            similarity = 1 - distance / 2                                       # Squared L2 between unit vectors is 2 - 2 cos
+            turn_id = (metadata or {}).get("turn_id")
+            if turn_id is not None and similarity >= self.min_similarity and similarity > turns.get(turn_id, (-1, 0))[0]:
+                turns[turn_id] = (similarity, metadata.get("timestamp") or 0.0)
+        now = time.time()
+        ranked = []
+        for turn_id, (similarity, timestamp) in turns.items():
+            recency = 0.5 ** (max(0.0, now - timestamp) / self.half_life)
+            ranked.append(((1 - self.recency_weight) * similarity + self.recency_weight * recency, turn_id))
+        ranked.sort(key=lambda entry: entry[0], reverse=True)
+        return [turn_id for _, turn_id in ranked[:self.top_k]]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "recalled": self.recalled,
+                "over_budget": self.over_budget,
+                "not_ready": self.not_ready,
+                "failed": self.failed,
+                "pending": self.pending,
+                "lookup_ms": round(self.lookup_ms, 1),
+                "budget_ms": self.budget_ms
+            }
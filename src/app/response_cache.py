@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import xxhash
+
+'''
+This module caches finished LLM responses and merges identical requests that are in flight at the same time.
+
+ResponseCache is keyed by an xxhash of the request sent to Ollama (model, prompt, options and context), so the
+same question about the same document gets the stored answer instead of a new generation. Entries expire after
+ttl seconds and the least recently used are evicted beyond max_entries. Results that carry an "error" are
+handed to the requests waiting on them but never stored.
+
+get_or_fetch is single-flight: the first caller for a key runs fetch(), and everyone asking for the same key
+meanwhile waits for that result instead of sending their own request. aget_or_fetch is the asyncio version; it
+shares the same in-flight table, so sync and async callers coalesce with each other. When the caller running
+the fetch is cancelled because its client went away, the requests waiting on it claim the key again, so one of
+them takes over the generation instead of failing with it.
+
+Example usage:
+cache = ResponseCache(max_entries=1024, ttl=600)
+result = cache.get_or_fetch(data, lambda: client.post(api_url, data).json())
+print(cache.stats())                                   # hits, coalesced, misses, hit_rate
+'''
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl                                                          # Seconds a stored response stays valid
+        self.entries = OrderedDict()                                            # key -> (expires, result)
+        self.inflight = {}                                                      # key -> Future shared by identical requests
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def key(self, request):
+        return xxhash.xxh3_128_hexdigest(json.dumps(request, sort_keys=True))
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    # Stored result for the request, or None; does not wait for requests in flight
+    def get(self, request):
+        key = self.key(request)
+        with self.lock:
+            result = self._get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def put(self, request, result):
+        self._store(self.key(request), result)
+
+    def _store(self, key, result):
+        if result.get("error"):
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Returns (future, owner); the owner must call _resolve once it has the result
+    def _claim(self, key):
+        with self.lock:
+            result = self._get(key)
+            if result is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(result)
+                return future, False
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            self.misses += 1
+            future = self.inflight[key] = Future()
+            return future, True
+
+    def _resolve(self, key, future, result=None, error=None):
+        if error is None:
+            self._store(key, result)
+        with self.lock:
+            self.inflight.pop(key, None)
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            future.set_result({"response": "Error: Request cancelled", "error": "cancelled"})  # Waiters retry rather than being cancelled too
+        else:
+            future.set_exception(error)
+
+    def get_or_fetch(self, request, fetch):
+        key = self.key(request)
+        future, owner = self._claim(key)
+        while not owner:
+            result = future.result()
+            if result.get("error") != "cancelled":
+                return result
+            future, owner = self._claim(key)
+        try:
+            result = fetch()
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, result)
+        return result
+
+    async def aget_or_fetch(self, request, fetch):
+        key = self.key(request)
+        future, owner = self._claim(key)
+        while not owner:
+            result = await asyncio.wrap_future(future)
+            if result.get("error") != "cancelled":
+                return result
+            future, owner = self._claim(key)
+        try:
+            result = await fetch()
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, result)
+        return result
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.coalesced + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,180 @@
+import re
+import threading
+
+import numpy as np
+
+'''
+This module splits extracted document and link text into overlapping chunks, embeds them once at upload time,
+and at chat time returns only the chunks most relevant to the user's question.
+
+The prompt built from retrieve() is capped by top_k and by an approximate token budget, so its size no longer grows
+with the size of the uploaded document.
+
+add() indexes a string held in memory. add_file() indexes a UTF-8 text file as a stream: it keeps only the byte
+offsets of each chunk and the embeddings, and retrieve() reads back just the selected chunks, so large documents
+are never loaded into memory as a whole. add_stream() does the same for any source that can be opened again as a
+binary file, such as a text in the shared content store, and can tag the entry with the version it was built from.
+
+Example usage:
+index = ChunkIndex(sentence_model)
+index.add_file("report.pdf", "documents/.extracted/report.pdf.txt")
+context = index.retrieve("report.pdf", "What was the revenue in 2023?")
+chunk_ids = index.select("report.pdf", "And in 2024?")                        # the same selection as ids, see render()
+index.add_stream("notes.txt", lambda: documents.open("notes.txt"), tag=documents.generation("notes.txt"))
+'''
+
+CHUNK_WORDS = 200                                                               # Words per chunk
+CHUNK_OVERLAP = 40                                                              # Words shared with the previous chunk so sentences are not cut in half
+DEFAULT_TOP_K = 4
+DEFAULT_TOKEN_BUDGET = 1024
+EMBED_BATCH = 64                                                                # Chunks embedded at a time while streaming a file
+READ_BLOCK = 1 << 16
+WORD_BYTES = re.compile(rb'\S+\s*')
+WHITESPACE_BYTES = re.compile(rb'\s')
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text with the llama tokenizer
+    return len(text) // 4 + 1
+
+def chunk_text(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = re.findall(r'\S+\s*', text)                                         # Keep the trailing whitespace so chunks read like the original
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append("".join(words[start:start + chunk_words]).strip())
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+# Same windows as chunk_text, as (start, end) byte offsets into a UTF-8 file read block by block
+def iter_chunk_spans(file, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = []
+    emitted = False
+    offset = 0
+    carry = b""
+    while True:
+        block = file.read(READ_BLOCK)
+        data = carry + block
+        base = offset - len(carry)
+        offset += len(block)
+        cut = len(data)
+        if block:
+            # Hold back a word that may continue in the next block
+            last_space = max((match.start() for match in WHITESPACE_BYTES.finditer(data, max(0, len(data) - 4096))), default=-1)
+            cut = last_space + 1 if last_space >= 0 else 0
+        carry = data[cut:]
+        for match in WORD_BYTES.finditer(data, 0, cut):
+            words.append((base + match.start(), base + match.end()))
+            if len(words) == chunk_words:
+                yield words[0][0], words[-1][1]
+                emitted = True
+                words = words[chunk_words - overlap:]
+        if not block:
+            break
+    if words and (not emitted or len(words) > overlap):
+        yield words[0][0], words[-1][1]
+
+def read_span(file, start, end):
+    file.seek(start)
+    return file.read(end - start).decode('utf-8', errors='ignore').strip()
+
+class ChunkIndex:
+    def __init__(self, model, top_k=DEFAULT_TOP_K, token_budget=DEFAULT_TOKEN_BUDGET):
+        self.model = model
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.entries = {}                                                       # name -> {"embeddings", "tag", and "chunks" or "open" + "spans"}
+        self.lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def encode(self, texts):
+        return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+    def add(self, name, text):
+        chunks = chunk_text(text)
+        embeddings = self.encode(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+        with self.lock:
+            self.entries[name] = {"chunks": chunks, "embeddings": embeddings}
+        return len(chunks)
+
+    def add_file(self, name, path):
+        return self.add_stream(name, lambda: open(path, 'rb'))
+
+    # opener returns a new binary file-like object over the text each time it is called
+    def add_stream(self, name, opener, tag=None):
+        spans = []
+        embeddings = []
+        batch = []
+        with opener() as file, opener() as reader:
+            for start, end in iter_chunk_spans(file):
+                spans.append((start, end))
+                batch.append(read_span(reader, start, end))
+                if len(batch) == EMBED_BATCH:
+                    embeddings.append(self.encode(batch))
+                    batch = []
+        if batch:
+            embeddings.append(self.encode(batch))
+        entry = {
+            "open": opener,
+            "tag": tag,
+            "spans": np.asarray(spans, dtype=np.int64).reshape(-1, 2),
+            "embeddings": np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        }
+        with self.lock:
+            self.entries[name] = entry
+        return len(spans)
+
+    def tag(self, name):
+        entry = self.entries.get(name)
+        return entry.get("tag") if entry is not None else None
+
+    def remove(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+    # Indices of the chunks most relevant to the query, in document order
+    def select(self, name, query, top_k=None, token_budget=None):
+        top_k = top_k or self.top_k
+        token_budget = token_budget or self.token_budget
+        entry = self.entries.get(name)
+        if entry is None or len(entry["embeddings"]) == 0:
+            return []
+
+        if "spans" in entry:
+            costs = (entry["spans"][:, 1] - entry["spans"][:, 0]) // 4 + 1
+        else:
+            costs = [estimate_tokens(chunk) for chunk in entry["chunks"]]
+
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        scores = entry["embeddings"] @ self.encode([query])[0]
+        selected = []
+        used = 0
+        for i in np.argsort(-scores):
+            if used + costs[i] > token_budget:
+                continue
+            selected.append(int(i))
+            used += costs[i]
+            if len(selected) >= top_k:
+                break
+
+        # Present the chunks in document order so the model reads them as a coherent excerpt
+        selected.sort()
+        return selected
+
+    def render(self, name, indices):
+        entry = self.entries.get(name)
+        if entry is None or not indices:
+            return ""
+        if "spans" in entry:
+            with entry["open"]() as file:
+                chunks = [read_span(file, *entry["spans"][i]) for i in indices]
+        else:
+            chunks = [entry["chunks"][i] for i in indices]
+        return "\n...\n".join(chunks)
+
+    def retrieve(self, name, query, top_k=None, token_budget=None):
+        return self.render(name, self.select(name, query, top_k, token_budget))
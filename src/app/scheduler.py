@@ -0,0 +1,205 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from src.app.metrics import LLM_QUEUE_SECONDS
+
+'''
+This module decides which LLM request goes to the model next when more arrive than a model can serve.
+
+LLMScheduler gives every model a number of slots (requests sent to Ollama at once) and a bounded queue for the
+rest. Waiting requests are grouped by priority and then by conversationId. Simple chats (PRIORITY_SIMPLE) always
+go before reasoning chains (PRIORITY_REASONING), and both go before background work such as memory compaction
+(PRIORITY_BACKGROUND). Within a priority, conversations take turns, so one client sending many requests cannot
+push everyone else back.
+
+Every request waits at most max_wait seconds. check() estimates the wait from the queue ahead and the recent
+time per request, and raises SchedulerBusy straight away when the queue is full or the wait would be longer
+than that. A request whose deadline passes while it waits gets the same error. SchedulerBusy carries a
+retry_after in seconds for the Retry-After header.
+
+Example usage:
+scheduler = LLMScheduler(slots={"deepseek-r1:1.5b": 1}, default_slots=4, max_queue=64, max_wait=30)
+scheduler.check("llama3.2:1B", PRIORITY_SIMPLE)               # raises SchedulerBusy when overloaded
+with scheduler.slot("llama3.2:1B", conversation_id="42", priority=PRIORITY_SIMPLE):
+    response = client.post(api_url, data)
+'''
+
+PRIORITY_SIMPLE = 0
+PRIORITY_REASONING = 1
+PRIORITY_BACKGROUND = 2
+
+# "llama3.2:1B=4,deepseek-r1:1.5b=1" -> {"llama3.2:1B": 4, "deepseek-r1:1.5b": 1}
+def parse_slots(spec):
+    slots = {}
+    for entry in spec.replace(';', ',').split(','):
+        model, _, count = entry.strip().rpartition('=')
+        if model:
+            slots[model] = int(count)
+    return slots
+
+class SchedulerBusy(Exception):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Waiter:
+    def __init__(self, key, priority, deadline, loop=None):
+        self.key = key
+        self.priority = priority
+        self.deadline = deadline
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+class _ModelQueue:
+    def __init__(self, slots):
+        self.slots = slots
+        self.active = 0
+        self.waiting = {}                                                       # priority -> OrderedDict(conversation -> deque of waiters)
+        self.size = 0
+        self.service_time = 1.0                                                 # Moving average of seconds a request holds a slot
+
+    def ahead_of(self, priority):
+        return sum(sum(len(waiters) for waiters in self.waiting[level].values()) for level in self.waiting if level <= priority)
+
+class LLMScheduler:
+    def __init__(self, slots=None, default_slots=4, max_queue=64, max_wait=30):
+        self.slots = dict(slots or {})
+        self.default_slots = default_slots
+        self.max_queue = max_queue                                              # Requests waiting per model
+        self.max_wait = max_wait                                                # Seconds a request may wait for a slot
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    # Requests that can be sent to these models at once
+    def capacity(self, models):
+        return sum(self.slots.get(model, self.default_slots) for model in set(models))
+
+    def _queue(self, model):
+        queue = self.queues.get(model)
+        if queue is None:
+            queue = self.queues[model] = _ModelQueue(self.slots.get(model, self.default_slots))
+        return queue
+
+    def _estimate(self, queue, priority):
+        waiting = queue.ahead_of(priority) + 1 - max(0, queue.slots - queue.active)
+        return max(0.0, waiting / queue.slots * queue.service_time)
+
+    def _busy(self, model, message, wait):
+        self.rejected += 1
+        return SchedulerBusy(f"{model} is busy, {message}", max(1, math.ceil(wait)))
+
+    # Fail fast when a request for the model could not start before its deadline
+    def check(self, model, priority=PRIORITY_SIMPLE):
+        with self.lock:
+            queue = self._queue(model)
+            wait = self._estimate(queue, priority)
+            if queue.size >= self.max_queue:
+                raise self._busy(model, "the queue is full", wait)
+            if wait > self.max_wait:
+                raise self._busy(model, f"expected wait is {wait:.0f}s", wait - self.max_wait)
+
+    def _enqueue(self, model, conversation_id, priority, loop=None):
+        with self.lock:
+            queue = self._queue(model)
+            if queue.size >= self.max_queue:
+                raise self._busy(model, "the queue is full", self._estimate(queue, priority))
+            waiter = _Waiter(None, priority, time.monotonic() + self.max_wait, loop)
+            waiter.key = conversation_id if conversation_id is not None else id(waiter)  # Anonymous requests queue on their own
+            conversations = queue.waiting.setdefault(priority, OrderedDict())
+            conversations.setdefault(waiter.key, deque()).append(waiter)
+            queue.size += 1
+            self._dispatch(queue)
+            return queue, waiter
+
+    def _dispatch(self, queue):
+        while queue.active < queue.slots and queue.size:
+            conversations = queue.waiting[min(level for level in queue.waiting if queue.waiting[level])]
+            key, waiters = next(iter(conversations.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                conversations.move_to_end(key)                                  # Round robin between conversations
+            else:
+                del conversations[key]
+            queue.size -= 1
+            queue.active += 1
+            waiter.grant()
+
+    # Leave the queue after a timeout; returns True if the slot was granted just before
+    def _withdraw(self, queue, waiter):
+        with self.lock:
+            if waiter.granted:
+                return True
+            waiters = queue.waiting[waiter.priority][waiter.key]
+            waiters.remove(waiter)
+            if not waiters:
+                del queue.waiting[waiter.priority][waiter.key]
+            queue.size -= 1
+            return False
+
+    def _expired(self, model, queue, waiter):
+        with self.lock:
+            return self._busy(model, f"no slot within {self.max_wait}s", self._estimate(queue, waiter.priority))
+
+    def _release(self, queue, started):
+        with self.lock:
+            queue.active -= 1
+            queue.service_time = 0.8 * queue.service_time + 0.2 * (time.monotonic() - started)
+            self._dispatch(queue)
+
+    @contextmanager
+    def slot(self, model, conversation_id=None, priority=PRIORITY_SIMPLE):
+        queue, waiter = self._enqueue(model, conversation_id, priority)
+        if not waiter.event.wait(max(0.0, waiter.deadline - time.monotonic())) and not self._withdraw(queue, waiter):
+            raise self._expired(model, queue, waiter)
+        started = time.monotonic()
+        LLM_QUEUE_SECONDS.observe(started - (waiter.deadline - self.max_wait), model=model)
+        try:
+            yield
+        finally:
+            self._release(queue, started)
+
+    @asynccontextmanager
+    async def aslot(self, model, conversation_id=None, priority=PRIORITY_SIMPLE):
+        queue, waiter = self._enqueue(model, conversation_id, priority, asyncio.get_running_loop())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, waiter.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if not self._withdraw(queue, waiter):
+                raise self._expired(model, queue, waiter)
+        except asyncio.CancelledError:
+            # The caller went away while waiting; give back the slot if it was granted meanwhile
+            if self._withdraw(queue, waiter):
+                self._release(queue, time.monotonic())
+            raise
+        started = time.monotonic()
+        LLM_QUEUE_SECONDS.observe(started - (waiter.deadline - self.max_wait), model=model)
+        try:
+            yield
+        finally:
+            self._release(queue, started)
+
+    def stats(self):
+        with self.lock:
+            models = {model: {"slots": queue.slots, "active": queue.active, "waiting": queue.size,
+                              "service_time": round(queue.service_time, 3)} for model, queue in self.queues.items()}
+            return {"models": models, "rejected": self.rejected}
@@ -0,0 +1,81 @@
+import threading
+import time
+
+'''
+This module keeps heavy dependencies off the import path so the API can start serving quickly.
+
+LazyResource wraps a factory (loading the sentence transformer, opening Chroma, importing crawl4ai, ...) and only
+runs it the first time get() is called, or ahead of time on a background thread with warm().
+Concurrent callers wait for the same load instead of starting their own.
+StartupTimer records how long each startup stage took so the breakdown can be printed once the app is ready.
+
+Example usage:
+sentence_model = LazyResource("sentence_model", lambda: SentenceTransformer('all-MiniLM-L6-v2'))
+sentence_model.warm()                           # start loading in the background
+vector = sentence_model.get().encode("hi")      # waits for the load if it is still running
+'''
+
+class LazyResource:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.state = "not_loaded"                                               # not_loaded, loading, loaded or failed
+        self.error = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.state == "loaded"
+
+    def get(self):
+        if self.state == "loaded":
+            return self.value
+        with self.lock:
+            if self.state != "loaded":
+                self.state = "loading"
+                start = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.state = "failed"
+                    self.error = str(e)
+                    print(f"Failed to load {self.name}: {e}")
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                self.state = "loaded"
+                print(f"Loaded {self.name} in {self.load_seconds * 1000:.0f} ms")
+        return self.value
+
+    # Load on a background thread; failures are recorded in the status instead of raised
+    def warm(self):
+        def load():
+            try:
+                self.get()
+            except Exception:
+                pass
+        threading.Thread(target=load, name=f"warm-{self.name}", daemon=True).start()
+
+    def status(self):
+        status = {"state": self.state}
+        if self.load_seconds is not None:
+            status["load_ms"] = round(self.load_seconds * 1000)
+        if self.error:
+            status["error"] = self.error
+        return status
+
+class StartupTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def report(self):
+        breakdown = ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in self.stages)
+        print(f"Startup took {(self.last - self.started) * 1000:.0f} ms ({breakdown})")
@@ -442,6 +442,41 @@ const Chatbot: React.FC = () => {
         return isEqual(memory1, memory2);
     };
 
+    // Read the server-sent events from /chat, calling onUpdate with the text of the current stage
+    const readChatStream = async (response: Response, onUpdate: (text: string) => void) => {
+        const reader = response.body!.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let stage = '';
+        let text = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop() ?? '';
+            for (const event of events) {
+                const line = event.split('\n').find(l => l.startsWith('data: '));
+                if (!line) {
+                    continue;
+                }
+                const payload = JSON.parse(line.slice(6));
+                if (payload.done) {
+                    return payload.response as string;
+                }
+                if (payload.stage !== stage) {
+                    stage = payload.stage;
+                    text = '';
+                }
+                text += payload.token;
+                onUpdate(text);
+            }
+        }
+        return text;
+    };
+
     const handleSendMessage = async () => {
         if (input.trim()) {
             const newMessage = { text: input, sender: 'user' };
@@ -459,12 +494,22 @@ const Chatbot: React.FC = () => {
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ message: userMessage, document: selectedDocument, link: selectedLink, reasoning: reasoningMode, memories: retrievedMemories, conversationId: selectedChat }),
+                    body: JSON.stringify({ message: userMessage, document: selectedDocument, link: selectedLink, reasoning: reasoningMode, memories: retrievedMemories, conversationId: selectedChat, stream: true }),
                 });
     
-                const data = await response.json();
-                const botMessage = { text: data.response, sender: 'bot' };
-                setMessages(prevMessages => [...prevMessages, botMessage]);
+                let botText: string;
+                if (response.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+                    // Show tokens as they arrive instead of waiting for the whole answer
+                    setMessages(prevMessages => [...prevMessages, { text: '', sender: 'bot' }]);
+                    botText = await readChatStream(response, text => {
+                        setMessages(prevMessages => [...prevMessages.slice(0, -1), { text, sender: 'bot' }]);
+                    });
+                } else {
+                    const data = await response.json();
+                    botText = data.response;
+                    setMessages(prevMessages => [...prevMessages, { text: botText, sender: 'bot' }]);
+                }
+                const botMessage = { text: botText, sender: 'bot' };
     
                 if (selectedChat !== null) {
                     const updatedHistory = chatHistory.map(chat => {
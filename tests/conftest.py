@@ -0,0 +1,53 @@
+import socket
+import threading
+
+import pytest
+
+from bench.stub_ollama import serve
+
+class StubBackend:
+    def __init__(self, **options):
+        self.options = options
+        self.server = None
+        self.port = 0
+        self.connections = []
+
+    def start(self):
+        self.server = serve(self.port, **self.options)                          # Port 0 picks a free one, restarts reuse it
+        self.port = self.server.server_address[1]
+        accept = self.server.get_request
+        def get_request():
+            connection = accept()
+            self.connections.append(connection[0])
+            return connection
+        self.server.get_request = get_request
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    # Like a crashed Ollama: keep-alive connections are cut too, not just the listening socket
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.connections = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+@pytest.fixture
+def stub_backend():
+    backends = []
+    def start(**options):
+        backend = StubBackend(**dict({"latency": 0.01, "tokens": 5, "tokens_per_second": 500}, **options)).start()
+        backends.append(backend)
+        return backend
+    yield start
+    for backend in backends:
+        if backend.server is not None:
+            backend.stop()
@@ -0,0 +1,53 @@
+import time
+
+from src.app import extractors
+from src.app.ingestion import IngestionQueue
+from src.app.library import DocumentLibrary
+
+def wait_for(ingestion, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = ingestion.get(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish within {timeout} seconds")
+
+def make_library(folder):
+    return DocumentLibrary(str(folder), lambda filepath, output_path: extractors.extract_to_file(filepath, output_path, 10), {"txt"})
+
+def make_ingestion(library):
+    return IngestionQueue(extractors.extract_to_file, lambda name, chars: library.register(name), max_workers=1,
+                          on_failure=lambda name, error: library.discard(name))
+
+def test_failed_upload_is_not_listed_again(tmp_path):
+    library = make_library(tmp_path)
+    ingestion = make_ingestion(library)
+    try:
+        (tmp_path / "big.txt").write_text("x" * 100)
+        job = ingestion.submit("big.txt", str(tmp_path / "big.txt"), library.staging_path("big.txt"), 10)
+        job = wait_for(ingestion, job["id"])
+    finally:
+        ingestion.shutdown()
+
+    assert job["status"] == "failed"
+    assert "larger than 10" in job["error"]
+    library.scan()
+    assert "big.txt" not in library
+    assert not (tmp_path / "big.txt").exists()
+    assert "big.txt" not in make_library(tmp_path)                              # As listed after a restart
+
+def test_completed_upload_is_listed(tmp_path):
+    library = make_library(tmp_path)
+    ingestion = make_ingestion(library)
+    try:
+        (tmp_path / "small.txt").write_text("hello")
+        job = ingestion.submit("small.txt", str(tmp_path / "small.txt"), library.staging_path("small.txt"), 10)
+        job = wait_for(ingestion, job["id"])
+    finally:
+        ingestion.shutdown()
+
+    assert job["status"] == "completed"
+    library.scan()
+    assert library["small.txt"] == "hello"
+    assert "small.txt" in make_library(tmp_path)
@@ -0,0 +1,44 @@
+import pytest
+
+from src.app import extractors
+from src.app.library import DocumentLibrary, ExtractionFailed
+
+def counting_extract(calls):
+    def extract(filepath, output_path):
+        calls.append(filepath)
+        return extractors.extract_to_file(filepath, output_path, 10)
+    return extract
+
+def test_failed_extraction_is_not_repeated(tmp_path):
+    (tmp_path / "big.txt").write_text("x" * 100)
+    calls = []
+    library = DocumentLibrary(str(tmp_path), counting_extract(calls), {"txt"})
+    for _ in range(3):
+        with pytest.raises(ExtractionFailed, match="larger than 10"):
+            library["big.txt"]
+    assert len(calls) == 1
+
+    other_worker = DocumentLibrary(str(tmp_path), counting_extract(calls), {"txt"})
+    with pytest.raises(ExtractionFailed):
+        other_worker["big.txt"]
+    assert len(calls) == 1
+
+def test_replaced_file_is_extracted_again(tmp_path):
+    (tmp_path / "doc.txt").write_text("x" * 100)
+    calls = []
+    library = DocumentLibrary(str(tmp_path), counting_extract(calls), {"txt"})
+    with pytest.raises(ExtractionFailed):
+        library["doc.txt"]
+    (tmp_path / "doc.txt").write_text("short")
+    assert library["doc.txt"] == "short"
+    assert len(calls) == 2
+    assert library.store.failure("doc.txt") is None
+
+def test_failures_of_removed_files_are_dropped(tmp_path):
+    (tmp_path / "big.txt").write_text("x" * 100)
+    library = DocumentLibrary(str(tmp_path), counting_extract([]), {"txt"})
+    with pytest.raises(ExtractionFailed):
+        library["big.txt"]
+    (tmp_path / "big.txt").unlink()
+    library.scan()
+    assert library.store.failures() == {}
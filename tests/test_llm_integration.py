@@ -0,0 +1,49 @@
+import asyncio
+
+from src.app.cancellation import CancelToken
+from src.app.llm_integration import LLMIntegration
+from src.app.llm_router import Backend, LLMRouter
+from src.app.scheduler import LLMScheduler
+
+def collect(generator):
+    async def run():
+        return [token async for token in generator]
+    return asyncio.run(run())
+
+def test_async_stream_stops_once_cancelled(stub_backend):
+    backend = stub_backend(tokens=50, tokens_per_second=200)
+    llm = LLMIntegration(f"{backend.url}/api/generate")
+    cancel = CancelToken()
+    async def run():
+        tokens = []
+        async for token in llm.astream_simple_response("hello there", cancel=cancel):
+            tokens.append(token)
+            if len(tokens) == 2:
+                cancel.cancel()
+        return tokens
+    tokens = asyncio.run(run())
+    assert len(tokens) == 2
+    assert llm.savings.stats()["aborted"] == 1
+
+def test_async_stream_skips_when_cancelled_before_start(stub_backend):
+    backend = stub_backend()
+    llm = LLMIntegration(f"{backend.url}/api/generate")
+    cancel = CancelToken()
+    cancel.cancel()
+    assert collect(llm.astream_simple_response("hello there", cancel=cancel)) == []
+    assert llm.savings.stats()["skipped_stages"] == 1
+
+def test_async_stream_without_cancel_completes(stub_backend):
+    backend = stub_backend(tokens=5)
+    llm = LLMIntegration(f"{backend.url}/api/generate")
+    assert "".join(collect(llm.astream_simple_response("hello there", cancel=CancelToken()))) == "".join(f"token{i} " for i in range(5))
+
+def test_default_clients_follow_scheduler_and_router():
+    llm = LLMIntegration(scheduler=LLMScheduler({"deepseek-r1:1.5b": 1}, default_slots=4))
+    assert llm.client.pool_size == 5                                            # 4 for the simple model, 1 for the reasoner
+    assert llm.client.max_concurrency is None
+    assert llm.client.max_retries > 0
+
+    llm = LLMIntegration(router=LLMRouter([Backend("http://127.0.0.1:1"), Backend("http://127.0.0.1:2")]))
+    assert llm.client.max_retries == 0
+    assert llm.async_client.max_retries == 0
@@ -0,0 +1,78 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.app.llm_client import LLMClient
+from src.app.llm_integration import LLMIntegration
+from src.app.llm_router import Backend, LLMRouter
+
+ANSWER = "".join(f"token{i} " for i in range(5))
+
+class Unavailable(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_error(503)
+
+    def do_POST(self):
+        self.send_error(503)
+
+def serve_unavailable():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Unavailable)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_router(*urls):
+    router = LLMRouter([Backend(url) for url in urls])
+    router.check_health()
+    return router
+
+def test_candidates_prefer_fewest_outstanding(stub_backend):
+    first, second = stub_backend(), stub_backend()
+    router = make_router(first.url, second.url)
+    busy = router.backends[0]
+    with router.track(busy):
+        assert router.candidates("llama3.2:1B")[0].url == second.url
+    with router.track(router.backends[1]), router.track(router.backends[1]):
+        assert router.candidates("llama3.2:1B")[0].url == first.url
+
+def test_fails_over_when_a_backend_dies_and_recovers(stub_backend):
+    first, second = stub_backend(), stub_backend()
+    router = make_router(first.url, second.url)
+    llm = LLMIntegration(router=router)
+    first.stop()
+
+    for _ in range(3):
+        assert llm.generate_simple_response("hello") == ANSWER
+    dead = router.backends[0]
+    assert not dead.healthy and dead.failures == 1                              # Skipped once marked unhealthy
+    assert router.candidates("llama3.2:1B")[0].url == second.url
+
+    router.check_health()
+    assert not dead.healthy
+    first.start()
+    router.check_health()
+    assert dead.healthy and dead.last_error is None
+
+def test_server_errors_mark_backend_unhealthy(stub_backend):
+    broken = serve_unavailable()
+    try:
+        healthy = stub_backend()
+        router = LLMRouter([Backend(f"http://127.0.0.1:{broken.server_address[1]}"), Backend(healthy.url)])
+        llm = LLMIntegration(router=router)
+        assert llm.generate_simple_response("hello") == ANSWER
+        assert not router.backends[0].healthy
+        assert router.backends[0].last_error == "HTTP 503"
+        router.check_health()
+        assert not router.backends[0].healthy
+    finally:
+        broken.shutdown()
+        broken.server_close()
+
+def test_timeouts_mark_backend_unhealthy(stub_backend):
+    slow, fast = stub_backend(latency=2), stub_backend()
+    router = make_router(slow.url, fast.url)
+    llm = LLMIntegration(router=router, client=LLMClient(timeouts={"llama3.2:1B": (1, 0.2)}, max_retries=0))
+    assert llm.generate_simple_response("hello") == ANSWER
+    assert not router.backends[0].healthy
+    assert "timed out" in router.backends[0].last_error.lower()
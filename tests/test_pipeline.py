@@ -0,0 +1,71 @@
+import threading
+
+from src.app.pipeline import Pipeline, parse_pipeline
+
+class FakeChatbot:
+    def __init__(self, cancel=None):
+        self.cancel = cancel
+        self.calls = []
+        self.skipped = []
+
+    def stream_reasoned_response(self, prompt, use_cache, schedule, cancel):
+        self.calls.append("reasoned")
+        yield "partial"
+        if self.cancel is not None:
+            self.cancel.set()                                                   # The peer closed; the token stream ends early
+
+    def stream_simple_response(self, prompt, session, chunks, use_cache, schedule, cancel):
+        self.calls.append("simple")
+        yield "answer"
+
+    def get_reasoned_response(self, prompt, use_cache, schedule, cancel):
+        self.calls.append("reasoned")
+        if self.cancel is not None:
+            self.cancel.set()
+        return "partial"
+
+    def get_simple_response(self, prompt, session, chunks, use_cache, schedule, cancel):
+        self.calls.append("simple")
+        return "answer"
+
+    def skip_stages(self, models):
+        self.skipped.extend(models)
+
+def test_stream_skips_later_stages_once_cancelled():
+    cancel = threading.Event()
+    chatbot = FakeChatbot(cancel)
+    pipeline = Pipeline(parse_pipeline("reasoning=reasoned,final=simple"), mode="always")
+    events = list(pipeline.stream(chatbot, "Why is the sky blue?", cancel=cancel))
+    assert chatbot.calls == ["reasoned"]
+    assert chatbot.skipped == ["simple"]
+    assert events == [{"stage": "reasoning", "token": "partial"}]
+
+def test_run_skips_later_stages_once_cancelled():
+    cancel = threading.Event()
+    chatbot = FakeChatbot(cancel)
+    pipeline = Pipeline(parse_pipeline("reasoning=reasoned,final=simple"), mode="always")
+    output, timings = pipeline.run(chatbot, "Why is the sky blue?", cancel=cancel)
+    assert chatbot.calls == ["reasoned"]
+    assert chatbot.skipped == ["simple"]
+    assert [timing["stage"] for timing in timings] == ["reasoning"]
+
+def test_stream_runs_every_stage():
+    chatbot = FakeChatbot()
+    pipeline = Pipeline(parse_pipeline("reasoning=reasoned,final=simple"), mode="always")
+    events = list(pipeline.stream(chatbot, "Why is the sky blue?", cancel=threading.Event()))
+    assert chatbot.calls == ["reasoned", "simple"]
+    assert events[-1]["done"] and events[-1]["response"] == "answer"
+
+class ChunkRecorder(FakeChatbot):
+    def get_simple_response(self, prompt, session, chunks, use_cache, schedule, cancel):
+        self.calls.append(("simple", prompt, chunks))
+        return "answer"
+
+def test_chunks_only_go_to_a_simple_stage_that_gets_the_excerpts():
+    chatbot = ChunkRecorder()
+    Pipeline(parse_pipeline("reasoning=reasoned,final=simple"), mode="never").run(chatbot, "excerpts and question", chunks={1, 2})
+    assert chatbot.calls == [("simple", "excerpts and question", {1, 2})]
+
+    chatbot = ChunkRecorder()
+    Pipeline(parse_pipeline("reasoning=reasoned,final=simple"), mode="always").run(chatbot, "excerpts and question", chunks={1, 2})
+    assert chatbot.calls[1][2] == ()                                            # Prompted with the reasoner's answer
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+
+from src.app.response_cache import ResponseCache
+
+def request(prompt):
+    return {"model": "llama3.2:1B", "prompt": prompt, "stream": False}
+
+def test_identical_requests_share_one_fetch():
+    cache = ResponseCache()
+    calls, release = [], threading.Event()
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {"response": "answer"}
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch(request("hi"), fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while cache.stats()["coalesced"] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"response": "answer"}] * 5
+    assert cache.stats()["coalesced"] == 4
+    assert cache.get_or_fetch(request("hi"), fetch) == {"response": "answer"}
+    assert len(calls) == 1                                                      # Stored, not fetched again
+
+def test_sync_and_async_callers_coalesce():
+    cache = ResponseCache()
+    calls, started = [], threading.Event()
+    async def fetch():
+        calls.append(1)
+        started.set()
+        await asyncio.sleep(0.2)
+        return {"response": "answer"}
+    results = []
+    def waiter():
+        started.wait(5)
+        results.append(cache.get_or_fetch(request("hi"), lambda: calls.append(1) or {"response": "other"}))
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert asyncio.run(cache.aget_or_fetch(request("hi"), fetch)) == {"response": "answer"}
+    thread.join()
+    assert results == [{"response": "answer"}]
+    assert len(calls) == 1
+
+def test_waiters_take_over_when_the_owner_is_cancelled():
+    cache = ResponseCache()
+    started = threading.Event()
+    def cancelled():
+        started.set()
+        time.sleep(0.1)
+        raise GeneratorExit()
+    results = []
+    def waiter():
+        started.wait(5)
+        results.append(cache.get_or_fetch(request("hi"), lambda: {"response": "retried"}))
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    try:
+        cache.get_or_fetch(request("hi"), cancelled)
+    except GeneratorExit:
+        pass
+    thread.join()
+    assert results == [{"response": "retried"}]
+
+def test_errors_are_shared_but_not_stored():
+    cache = ResponseCache()
+    assert cache.get_or_fetch(request("hi"), lambda: {"response": "Error", "error": 500})["error"] == 500
+    assert cache.get(request("hi")) is None
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.put(request("hi"), {"response": "answer"})
+    assert cache.get(request("hi")) == {"response": "answer"}
+    time.sleep(0.1)
+    assert cache.get(request("hi")) is None
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.put(request("a"), {"response": "a"})
+    cache.put(request("b"), {"response": "b"})
+    cache.get(request("a"))                                                     # "b" is now the least recently used
+    cache.put(request("c"), {"response": "c"})
+    assert cache.get(request("b")) is None
+    assert cache.get(request("a")) == {"response": "a"}
+    assert cache.get(request("c")) == {"response": "c"}
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.app.scheduler import LLMScheduler, SchedulerBusy, PRIORITY_SIMPLE, PRIORITY_REASONING, PRIORITY_BACKGROUND
+
+MODEL = "llama3.2:1B"
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+def waiting(scheduler):
+    return scheduler.stats()["models"][MODEL]["waiting"]
+
+def test_priorities_then_round_robin_between_conversations():
+    scheduler = LLMScheduler(default_slots=1)
+    release, order, threads = threading.Event(), [], []
+    def hold():
+        with scheduler.slot(MODEL):
+            release.wait(5)
+    def request(label, conversation_id, priority):
+        with scheduler.slot(MODEL, conversation_id, priority):
+            order.append(label)
+    holder = threading.Thread(target=hold)
+    holder.start()
+    wait_until(lambda: scheduler.stats()["models"].get(MODEL, {}).get("active") == 1)
+    for label, conversation_id, priority in [("compaction", "x", PRIORITY_BACKGROUND), ("reasoning", "a", PRIORITY_REASONING),
+                                             ("a1", "a", PRIORITY_SIMPLE), ("a2", "a", PRIORITY_SIMPLE),
+                                             ("b1", "b", PRIORITY_SIMPLE), ("c1", "c", PRIORITY_SIMPLE)]:
+        count = waiting(scheduler)
+        threads.append(threading.Thread(target=request, args=(label, conversation_id, priority)))
+        threads[-1].start()
+        wait_until(lambda: waiting(scheduler) == count + 1)
+    release.set()
+    for thread in [holder] + threads:
+        thread.join()
+    assert order == ["a1", "b1", "c1", "a2", "reasoning", "compaction"]
+
+def test_full_queue_is_rejected_with_retry_after():
+    scheduler = LLMScheduler(default_slots=1, max_queue=1)
+    release = threading.Event()
+    def hold():
+        with scheduler.slot(MODEL):
+            release.wait(5)
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: waiting(scheduler) == 1)
+    with pytest.raises(SchedulerBusy, match="the queue is full") as busy:
+        scheduler.check(MODEL)
+    assert busy.value.retry_after >= 1
+    with pytest.raises(SchedulerBusy):
+        with scheduler.slot(MODEL):
+            pass
+    assert scheduler.stats()["rejected"] == 2
+    release.set()
+    for thread in threads:
+        thread.join()
+
+def test_long_expected_wait_is_rejected_up_front():
+    scheduler = LLMScheduler(default_slots=1, max_wait=2)
+    release = threading.Event()
+    def hold():
+        with scheduler.slot(MODEL):
+            release.wait(5)
+    holder = threading.Thread(target=hold)
+    holder.start()
+    wait_until(lambda: scheduler.stats()["models"].get(MODEL, {}).get("active") == 1)
+    scheduler.queues[MODEL].service_time = 10.0                                 # As measured from earlier requests
+    with pytest.raises(SchedulerBusy, match="expected wait") as busy:
+        scheduler.check(MODEL)
+    assert busy.value.retry_after >= 1
+    release.set()
+    holder.join()
+
+def test_request_waiting_past_its_deadline_is_rejected():
+    scheduler = LLMScheduler(default_slots=1, max_wait=0.1)
+    release = threading.Event()
+    def hold():
+        with scheduler.slot(MODEL):
+            release.wait(5)
+    holder = threading.Thread(target=hold)
+    holder.start()
+    wait_until(lambda: scheduler.stats()["models"].get(MODEL, {}).get("active") == 1)
+    with pytest.raises(SchedulerBusy, match="no slot within"):
+        with scheduler.slot(MODEL):
+            pass
+    assert waiting(scheduler) == 0
+    release.set()
+    holder.join()
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    scheduler = LLMScheduler(default_slots=1)
+    async def run():
+        async with scheduler.aslot(MODEL):
+            task = asyncio.ensure_future(scheduler.aslot(MODEL).__aenter__())
+            await asyncio.sleep(0.05)
+            assert waiting(scheduler) == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert waiting(scheduler) == 0
+        assert scheduler.stats()["models"][MODEL]["active"] == 0
+    asyncio.run(run())